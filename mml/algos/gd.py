@@ -23,10 +23,14 @@ class GD_ERM(LineSearch):
     
     
     def newdir(self, X=None, y=None):
-        loss_grads = self.loss.grad(model=self.model, X=X, y=y)
+        '''
+        Only the mean gradient is needed here, so per-example
+        gradients are skipped where possible (see Loss.mean_grad).
+        '''
+        loss_grads = self.loss.mean_grad(model=self.model, X=X, y=y)
         newdirs = {}
         for pn, g in loss_grads.items():
-            newdirs[pn] = -g.mean(axis=0, keepdims=False)
+            newdirs[pn] = -g
         return newdirs
 
 
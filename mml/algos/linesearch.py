@@ -37,9 +37,15 @@ class LineSearch(Algorithm):
         
 
     def update(self, X=None, y=None):
+        '''
+        Model outputs and losses are memoized until the parameters
+        are updated, so they are computed once per update, however
+        many times newdir() and stepsize() evaluate them.
+        '''
 
-        newdirs = self.newdir(X=X, y=y)
-        update_step = self.stepsize(newdirs=newdirs, X=X, y=y)
+        with self.model.memoize():
+            newdirs = self.newdir(X=X, y=y)
+            update_step = self.stepsize(newdirs=newdirs, X=X, y=y)
         
         for pn, p in self.paras.items():
             
@@ -56,6 +62,7 @@ class LineSearch(Algorithm):
             ## Assuming shapes match, do additive update.
             p += update_step[pn] * newdirs[pn]
 
+        self.model.invalidate()
         return None
 
 
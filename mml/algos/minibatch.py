@@ -0,0 +1,223 @@
+'''Algorithms: minibatch driver for iterative algorithms.'''
+
+## External modules.
+import numpy as np
+import time
+
+
+###############################################################################
+
+
+## For reference:
+## Typical use, with any Algorithm that updates via update(X,y):
+##   driver = Minibatch(algo=GD_ERM(...), X=X_train, y=y_train,
+##                      batch_size=32, rg=rg)
+##   for onestep in driver:
+##       driver.algo.check(cond=(driver.epoch >= num_epochs))
+## Each step of the loop is one update of the algorithm using the next
+## minibatch; the loop ends once the algorithm's stop flag is raised,
+## exactly as when iterating over the algorithm itself. One can also
+## call run_epoch() repeatedly, or take batches via batches() (one
+## epoch) or next_batch(), and update the algorithm by hand.
+
+_last_policies = ["drop", "keep", "pad"]
+
+
+class Minibatch:
+    '''
+    Drives an Algorithm (e.g., GD_ERM or RGD_Mest, used as is)
+    over minibatches of the data (X, y), passing each one in
+    turn to algo.update(X=X_batch, y=y_batch).
+
+    Each epoch visits the rows in a new random order (drawn
+    from rg, by shuffling one index array in place), or in
+    their stored order if rg is None, cut into batches of
+    batch_size rows. The final, incomplete batch of an epoch
+    (if any) is handled as per last:
+    - "drop": skip it, so all batches have batch_size rows;
+    - "keep": use it as is (fewer rows);
+    - "pad": fill it up with rows from the start of the
+      current epoch's order, so all batches have batch_size
+      rows, and no rows are skipped.
+
+    For ndarray (incl. memory-mapped) data, batch rows are
+    gathered into preallocated buffers, so steps allocate no
+    memory proportional to the batch size. The batch arrays
+    are thus only valid until the next step; copy them if
+    they are needed for longer. Other data (e.g., scipy.sparse
+    matrices, or LazyArray handles) is indexed as usual.
+
+    Timing is recorded as the data is run through: time_update
+    is the total time spent in algo.update(), and time_steps
+    the total time of all steps, so the per-step overhead of
+    the driver itself is given by overhead_per_step.
+    '''
+
+    def __init__(self, algo, X, y=None, batch_size=32, rg=None,
+                 last="drop"):
+        if last not in _last_policies:
+            raise ValueError("last must be one of {}.".format(_last_policies))
+        n = X.shape[0]
+        if y is not None and len(y) != n:
+            raise ValueError(
+                "len(X) {} != len(y) {}".format(n, len(y))
+            )
+        if batch_size < 1 or (last == "drop" and batch_size > n):
+            raise ValueError("Need 1 <= batch_size <= n when dropping.")
+
+        self.algo = algo
+        self.X = X
+        self.y = y
+        self.n = n
+        self.batch_size = batch_size
+        self.rg = rg
+        self.last = last
+
+        ## Index buffers.
+        self._perm = np.arange(n, dtype=np.intp)
+        self._idx = np.empty(batch_size, dtype=np.intp) # padded batches.
+        self._pad = np.empty(batch_size, dtype=np.intp)
+        self._offsets = np.arange(batch_size, dtype=np.intp)
+
+        ## Batch buffers (ndarray data only).
+        self._X_buf = self._make_buffer(A=X)
+        self._y_buf = None if y is None else self._make_buffer(A=y)
+
+        ## State and timing.
+        self.epoch = 0 # number of epochs completed.
+        self.num_steps = 0
+        self.time_update = 0.0
+        self.time_steps = 0.0
+        self._pos = 0 # start of the next batch in the current order.
+        return None
+
+
+    def _make_buffer(self, A):
+        '''
+        Buffer to gather batch_size rows of A into, or None if A
+        is not an ndarray.
+        '''
+        if isinstance(A, np.ndarray):
+            return np.empty((self.batch_size,)+A.shape[1:], dtype=A.dtype)
+        else:
+            return None
+
+
+    def __len__(self):
+        '''
+        Number of steps (batches) per epoch.
+        '''
+        if self.last == "drop":
+            return self.n // self.batch_size
+        else:
+            return -(-self.n // self.batch_size)
+
+
+    def _gather(self, A, buf, idx):
+        '''
+        Rows idx of A, gathered into buf if possible.
+        '''
+        if buf is None:
+            return A[idx]
+        out = buf[0:len(idx)]
+        np.take(A, idx, axis=0, out=out, mode="clip") # no bounds buffer.
+        return out
+
+
+    def next_batch(self):
+        '''
+        The next minibatch (X_batch, y_batch) in the current epoch,
+        starting a new epoch (with a new order) when needed; y_batch
+        is None if y is None.
+        '''
+        start = self._pos
+        if start == 0 and self.rg is not None:
+            self.rg.shuffle(self._perm)
+        stop = start + self.batch_size
+        if stop <= self.n:
+            idx = self._perm[start:stop]
+        elif self.last == "keep":
+            idx = self._perm[start:]
+        else:
+            ## Pad by wrapping around to the start of the order.
+            np.add(self._offsets, start, out=self._pad)
+            np.take(self._perm, self._pad, mode="wrap", out=self._idx)
+            idx = self._idx
+
+        ## Move on, noting when an epoch is complete.
+        self._pos = stop
+        if self._pos >= len(self)*self.batch_size:
+            self._pos = 0
+            self.epoch += 1
+
+        X_batch = self._gather(A=self.X, buf=self._X_buf, idx=idx)
+        if self.y is None:
+            return (X_batch, None)
+        else:
+            return (X_batch, self._gather(A=self.y, buf=self._y_buf, idx=idx))
+
+
+    def batches(self):
+        '''
+        Generator over the minibatches of the rest of the current
+        epoch (all of it, unless some were already taken).
+        '''
+        epoch = self.epoch
+        while self.epoch == epoch:
+            yield self.next_batch()
+        return None
+
+
+    def step(self):
+        '''
+        One update of the algorithm, using the next minibatch.
+        '''
+        time_start = time.perf_counter()
+        X_batch, y_batch = self.next_batch()
+        time_update = time.perf_counter()
+        self.algo.update(X=X_batch, y=y_batch)
+        time_stop = time.perf_counter()
+        self.time_update += time_stop - time_update
+        self.time_steps += time_stop - time_start
+        self.num_steps += 1
+        return None
+
+
+    def run_epoch(self):
+        '''
+        Update the algorithm using all minibatches of the rest of
+        the current epoch (all of it, unless steps were taken).
+        '''
+        epoch = self.epoch
+        while self.epoch == epoch:
+            self.step()
+        return None
+
+
+    def __iter__(self):
+        return self
+
+
+    def __next__(self):
+        '''
+        Following the Algorithm protocol: raise StopIteration
+        once the algorithm has been told to stop (see
+        Algorithm.check), else do one step.
+        '''
+        next(self.algo)
+        self.step()
+        return None
+
+
+    @property
+    def overhead_per_step(self):
+        '''
+        Mean time (in seconds) per step spent outside of the
+        algorithm's update (batch selection and gathering).
+        '''
+        if self.num_steps == 0:
+            return None
+        return (self.time_steps-self.time_update) / self.num_steps
+
+
+###############################################################################
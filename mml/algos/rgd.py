@@ -5,6 +5,8 @@ import numpy as np
 
 ## Internal modules.
 from mml.algos.linesearch import LineSearch
+from mml.losses import get_grads
+from mml.utils.sparse import SparseJacobian
 
 
 ###############################################################################
@@ -32,26 +34,26 @@ class RGD_Mest(LineSearch):
         self.step_coef = {}
         for pn, p in self.paras.items():
             self.step_coef[pn] = step_coef
+        self._grad_buffers = {} # reused for per-example gradients.
         return None
     
     
     def newdir(self, X=None, y=None):
-        loss_grads = self.loss.grad(model=self.model, X=X, y=y)
+        loss_grads = get_grads(loss=self.loss, model=self.model, X=X, y=y,
+                               out=self._grad_buffers)
         newdirs = {}
         for pn, g in loss_grads.items():
 
-            ## Scale factor (Catoni 2012 style) before std dev estimate.
-            s_est = np.sqrt(len(g)/np.log(1.0/self.delta))
-
-            ## Multiply by std dev estimate.
-            s_est *= self.est_scale(
-                X=g-g.mean(axis=0, keepdims=True)
-            )
-
-            ## Location estimate using scaling, negative direction.
-            newdirs[pn] = -self.est_loc(X=g, s=s_est,
-                                        thres=self.mest_thres,
-                                        iters=self.mest_iters)
+            ## The estimates are coordinate-wise, so per-example
+            ## gradients of sparse inputs can be handled one
+            ## (densified) block of features at a time.
+            if isinstance(g, SparseJacobian):
+                newdirs[pn] = np.concatenate(
+                    [self.newdir_dense(g=g_block) for g_block in g.blocks()],
+                    axis=-2
+                )
+            else:
+                newdirs[pn] = self.newdir_dense(g=g)
 
             ## Ensure shapes match before proceeding.
             newdir_dim = newdirs[pn].ndim
@@ -72,6 +74,26 @@ class RGD_Mest(LineSearch):
         return newdirs
     
     
+    def newdir_dense(self, g):
+        '''
+        Robust (negative) direction from the dense array g of
+        per-example gradients, with examples on axis 0.
+        '''
+        
+        ## Scale factor (Catoni 2012 style) before std dev estimate.
+        s_est = np.sqrt(len(g)/np.log(1.0/self.delta))
+
+        ## Multiply by std dev estimate.
+        s_est *= self.est_scale(
+            X=g-g.mean(axis=0, keepdims=True)
+        )
+
+        ## Location estimate using scaling, negative direction.
+        return -self.est_loc(X=g, s=s_est,
+                             thres=self.mest_thres,
+                             iters=self.mest_iters)
+
+
     def stepsize(self, newdirs=None, X=None, y=None):
         '''
         Just return the pre-fixed step sizes.
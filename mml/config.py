@@ -17,5 +17,15 @@ dir_data_towrite = str(Path.cwd())
 ## Potential alternative setting:
 #   os.path.join(str(Path.home()), "data_master")
 
+## Directory (and size cap in bytes) for cached, preprocessed data splits.
+dir_data_cache = os.path.join(dir_data_towrite, "cache")
+cache_max_bytes = 2**34
+
+## Compression and chunking for HDF5 files written by the data scripts.
+h5_complib = "blosc:lz4" # e.g., "zlib", "blosc", "blosc:lz4", "blosc:zstd".
+h5_complevel = 5 # from 0 (no compression) to 9.
+h5_shuffle = True # byte-shuffle before compressing.
+h5_chunk_bytes = 2**18 # approximate size of each (row-block) chunk.
+
 
 ###############################################################################
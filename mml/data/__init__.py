@@ -3,10 +3,17 @@
 ## External modules.
 import numpy as np
 import os
+from scipy.sparse import issparse
 from tables import open_file
 
 ## Internal modules.
-from mml.utils.linalg import onehot
+from mml.data import cache
+from mml.data.lazy import LazyArray, get_lazy, load_sidecar, write_sidecar
+from mml.data.libsvm import is_csr, read_csr
+from mml.data.manifest import check_output
+from mml.data.splits import get_split_indices, load_split, save_split
+from mml.data.stats import get_minmax_stored, get_stats
+from mml.utils.linalg import onehot, permute_rows
 
 
 ###############################################################################
@@ -17,6 +24,9 @@ from mml.utils.linalg import onehot
 ## - type: the type of learning problem the data is to be used for.
 ## - num_classes 
 ## - chance_level: when not None, this is #(majority class)/#(all classes).
+## - label_col: when present, the column of the stored y to use as labels
+##   (for cifar100, column 0 holds fine labels and column 1 coarse labels,
+##   unless the data was prepared with a different label_type).
 
 dataset_dict = {
     "adult": {"type": "classification",
@@ -37,6 +47,7 @@ dataset_dict = {
     "cifar100": {"type": "classification",
                  "num_classes": 100,
                  "chance_level": None,
+                 "label_col": 0,
                  "pix_h": 32,
                  "pix_w": 32,
                  "channels": 3},
@@ -110,12 +121,106 @@ dtype_X = np.float32
 
 ## General-purpose data-preparation functions.
 
-def get_data(dataset, paras, rg, directory):
+def get_dtype_X(node, paras, keep_uint8=False):
+    '''
+    Dtype that X (stored in the given node) is read as.
+    '''
+    if keep_uint8 and "pix_h" in paras and node.dtype == np.uint8:
+        return np.dtype(np.uint8)
+    else:
+        return np.dtype(dtype_X)
+
+
+def get_dtype_y(paras):
+    '''
+    Dtype that labels y are read as.
+    '''
+    if paras["type"] == "classification":
+        return np.dtype(np.int64)
+    elif paras["type"] == "regression":
+        return np.dtype(np.float32)
+    else:
+        raise ValueError("Unknown dataset type given.")
+
+
+def write_sidecars(dataset, paras, directory, keep_uint8=False):
+    '''
+    Write .npy sidecars of X and y (if any) for the existing
+    [directory]/[dataset]/[dataset].h5, in the dtypes that
+    get_data() reads them as (with the given keep_uint8), so
+    that reading them is just a memory map (see get_data).
+    Sparse X gets no sidecar. Sidecars are only used while
+    at least as new as the HDF5 file, so after converting
+    again, they must be written again too; sidecars that are
+    up to date (and of the right dtype) are left as is.
+    '''
+    toread = os.path.join(directory, dataset, "{}.h5".format(dataset))
+    with open_file(toread, mode="r") as f:
+        X_node = f.get_node(where=f.root, name="X")
+        todo = {}
+        if not is_csr(node=X_node):
+            todo["X"] = (get_dtype_X(node=X_node, paras=paras,
+                                     keep_uint8=keep_uint8), X_node.shape)
+        if "y" in f.root:
+            todo["y"] = (get_dtype_y(paras=paras), f.root.y.shape)
+    for name, (dtype, shape) in todo.items():
+        current = load_sidecar(toread=toread, name=name, shape=shape)
+        if current is not None and current.dtype == dtype:
+            continue
+        del current
+        write_sidecar(toread=toread, name=name, dtype=dtype)
+    return None
+
+
+def get_data(dataset, paras, rg, directory, lazy=False, keep_uint8=False,
+             verify=False, mmap_mode="c"):
+    '''
+    Get dataset from [directory]/[dataset]/[dataset].h5, returning
+    the pair (X,y), where y is None for datasets without labels.
+
+    By default X and y are read fully into memory as ndarrays of
+    the default dtypes. If lazy is True, then X and y are instead
+    LazyArray handles (see mml.data.lazy), which only read and
+    convert the rows that are actually indexed. These handles
+    are backed by [dataset]_X.npy and [dataset]_y.npy (memory-mapped
+    read-only) when such sidecar files exist (and are at least as
+    new as the HDF5 file), else by the HDF5 nodes.
+
+    Otherwise, up-to-date sidecars (see write_sidecars) are also
+    preferred to the HDF5 nodes: they are memory-mapped with the
+    given mmap_mode, and only cast if their dtype is not the
+    target one. With the default "c" (copy-on-write), the arrays
+    can be modified as usual, but pages that are never written
+    stay shared with other processes mapping the same files;
+    with "r", the arrays are read-only.
+
+    Features stored in sparse (CSR) form, as written by
+    mml.data.libsvm, are read as a scipy.sparse CSR matrix;
+    these cannot be read lazily.
+
+    If keep_uint8 is True, image datasets (those with "pix_h"
+    in paras) stored as uint8 keep X in that dtype.
+
+    If verify is True, the file is first checked against the
+    manifest written when it was converted (see mml.data.manifest);
+    this only reads a few small blocks of the file. A ValueError
+    is raised on mismatch; files without a manifest are read as is.
+    '''
 
     ## File to read from.
     toread = os.path.join(directory, dataset,
                           "{}.h5".format(dataset))
 
+    ## Cheap integrity check, if prescribed.
+    if verify:
+        is_intact = check_output(toread=toread)
+        if is_intact is None:
+            print("No manifest for {}; not verified.".format(toread))
+        elif not is_intact:
+            raise ValueError(
+                "{} does not match its manifest.".format(toread)
+            )
+
     ## Open the file, convert to default dtypes and do basic checks.
     with open_file(toread, mode="r") as f:
         
@@ -123,25 +228,52 @@ def get_data(dataset, paras, rg, directory):
         node_list = f.list_nodes(where=f.root)
 
         ## Assume that all datasets include at least an "X" node.
-        X = f.get_node(where=f.root, name="X").read().astype(dtype_X)
+        X_node = f.get_node(where=f.root, name="X")
+        if is_csr(node=X_node):
+            if lazy:
+                raise ValueError("Sparse X cannot be read lazily.")
+            X = read_csr(node=X_node).astype(dtype_X, copy=False)
+        else:
+            dtype = get_dtype_X(node=X_node, paras=paras,
+                                keep_uint8=keep_uint8)
+            if lazy:
+                X = get_lazy(toread=toread, name="X", dtype=dtype)
+            else:
+                X = load_sidecar(toread=toread, name="X",
+                                 mmap_mode=mmap_mode, shape=X_node.shape)
+                if X is None:
+                    X = X_node.read()
+                X = X.astype(dtype, copy=False)
         print("Type: X ({})".format(type(X)))
 
         ## In addition, there can be at most one more node, called "y".
         if len(node_list) == 1:
             y = None
         elif len(node_list) == 2:
-            if paras["type"] == "classification":
-                dtype_y = np.int64
-            elif paras["type"] == "regression":
-                dtype_y = np.float32
+            dtype_y = get_dtype_y(paras=paras)
+
+            ## Label column of interest (if any).
+            if "label_col" in paras:
+                cols = slice(paras["label_col"], paras["label_col"]+1)
             else:
-                raise ValueError("Unknown dataset type given.")
-                
-            y = f.get_node(where=f.root, name="y").read().astype(dtype_y)
+                cols = slice(None)
+            
+            if lazy:
+                y = get_lazy(toread=toread, name="y", dtype=dtype_y,
+                             cols=cols)
+            else:
+                y_node = f.get_node(where=f.root, name="y")
+                y = load_sidecar(toread=toread, name="y",
+                                 mmap_mode=mmap_mode, shape=y_node.shape)
+                if y is None:
+                    y = y_node[:,cols]
+                else:
+                    y = np.ascontiguousarray(y[:,cols])
+                y = y.astype(dtype_y, copy=False)
             print("Type: y ({})".format(type(y)))
-            if len(X) != len(y):
+            if X.shape[0] != y.shape[0]:
                 raise ValueError(
-                    "len(X) {} != len(y) {}".format(len(X),len(y))
+                    "len(X) {} != len(y) {}".format(X.shape[0],y.shape[0])
                 )
         else:
             raise ValueError("Dataset has more than two child nodes in root.")
@@ -149,8 +281,63 @@ def get_data(dataset, paras, rg, directory):
     return (X,y)
 
 
+def get_pixel_scaling(X, paras, scaling="minmax", chunk_rows=2**12,
+                      stats=None):
+    '''
+    Per-feature (shift, scale) for dequantizing the uint8 image
+    data X as (X-shift)/scale, each of shape (num_features,),
+    computed without ever converting all of X to float.
+    - "minmax": per-feature min-max, as in get_data_general.
+    - "unit": just divide by 255, giving values in [0,1].
+    - "standardize": per-channel mean and standard deviation,
+      assuming channel-major features (as in CIFAR).
+    If stats (as from mml.data.stats.read_stats) for all of X
+    are given, they are used instead of a pass over X.
+    '''
+    if scaling == "minmax":
+        if stats is None:
+            shift = X.min(axis=0).astype(dtype_X)
+            scale = X.max(axis=0).astype(dtype_X) - shift
+        else:
+            shift = stats["min"].astype(dtype_X)
+            scale = stats["max"].astype(dtype_X) - shift
+    elif scaling == "unit":
+        shift = np.zeros(X.shape[1], dtype=dtype_X)
+        scale = np.full(X.shape[1], 255, dtype=dtype_X)
+    elif scaling == "standardize" and stats is not None:
+        ## Pool per-feature moments within each channel.
+        means = stats["mean"].reshape((paras["channels"],-1))
+        sq_means = stats["var"].reshape((paras["channels"],-1)) + means**2
+        num_pixels = means.shape[1]
+        means = means.mean(axis=1)
+        sds = np.sqrt(np.clip(sq_means.mean(axis=1)-means**2,
+                              a_min=0.0, a_max=None))
+        shift = np.repeat(means, num_pixels).astype(dtype_X)
+        scale = np.repeat(sds, num_pixels).astype(dtype_X)
+    elif scaling == "standardize":
+        num_pixels = paras["pix_h"]*paras["pix_w"]
+        sums = np.zeros(paras["channels"])
+        sums_sq = np.zeros(paras["channels"])
+        for start in range(0, len(X), chunk_rows):
+            X_chunk = X[start:(start+chunk_rows)].reshape(
+                (-1, paras["channels"], num_pixels)
+            ).astype(np.float64)
+            sums += X_chunk.sum(axis=(0,2))
+            sums_sq += (X_chunk**2).sum(axis=(0,2))
+        count = len(X)*num_pixels
+        means = sums/count
+        sds = np.sqrt(np.clip(sums_sq/count-means**2, a_min=0.0, a_max=None))
+        shift = np.repeat(means, num_pixels).astype(dtype_X)
+        scale = np.repeat(sds, num_pixels).astype(dtype_X)
+    else:
+        raise ValueError("Unknown pixel scaling: {}".format(scaling))
+    return (shift, scale)
+
+
 def get_data_general(dataset, paras, rg, directory, do_normalize=True,
-                     do_shuffle=True, do_onehot=True):
+                     do_shuffle=True, do_onehot=True, use_cache=False,
+                     keep_uint8=False, pixel_scaling="minmax",
+                     verify=False, split_name=None):
     '''
     Get dataset and split into training, testing, and validation subsets.
     
@@ -158,10 +345,57 @@ def get_data_general(dataset, paras, rg, directory, do_normalize=True,
     the dataset_dict defined here in mml.data, or that the
     accompanying "paras" argument is formatted in the same way
     as the entries in dataset_dict.
+
+    For classification, do_onehot=False keeps the labels as (n,1)
+    class indices, which the Logistic and Zero_One losses accept
+    in place of (much larger) one-hot label matrices.
+
+    If use_cache is True, the splits are looked up in (and
+    otherwise saved to) the on-disk cache of mml.data.cache;
+    cached splits are returned as read-only memory-mapped arrays.
+    Splits of sparse data are returned as scipy.sparse CSR
+    matrices, and are not cached.
+
+    If keep_uint8 is True, image datasets stored as uint8 stay
+    that way in memory (4x smaller than float32), and the X
+    splits are returned as LazyArray handles which dequantize
+    to float32 only the rows being read (or one block of rows
+    at a time for X @ w). Normalization then follows
+    pixel_scaling (see get_pixel_scaling); with the default
+    "minmax", rows are exactly as in the usual float32 splits.
+    The cache is not used in this mode.
+
+    If verify is True, the file is checked first (see get_data).
+
+    If split_name is given, the split is the one stored under that
+    name (see mml.data.splits), so it is the same across runs
+    whatever the state of rg; if there is no such split yet, it is
+    drawn from rg as usual, and stored. The subset sizes are then
+    those of the stored split.
+
+    Normalization uses the per-feature statistics stored with the
+    data at conversion time (see mml.data.stats) when available,
+    saving a pass over X; the result is the same either way.
     '''
 
+    toread = os.path.join(directory, dataset, "{}.h5".format(dataset))
+
+    ## Look for ready-made splits in the cache if prescribed.
+    use_cache = use_cache and not keep_uint8
+    if use_cache:
+        cache_key = cache.get_key(toread=toread, paras=paras, rg=rg,
+                                  do_normalize=do_normalize,
+                                  do_shuffle=do_shuffle,
+                                  do_onehot=do_onehot,
+                                  split_name=split_name)
+        splits = cache.load(key=cache_key, paras=paras, rg=rg)
+        if splits is not None:
+            return splits + (paras,)
+    
     ## First get the data in ndarray form and run basic checks.
-    X, y = get_data(dataset=dataset, paras=paras, rg=rg, directory=directory)
+    X, y = get_data(dataset=dataset, paras=paras, rg=rg, directory=directory,
+                    keep_uint8=keep_uint8, verify=verify)
+    is_quantized = X.dtype == np.uint8
     
     ## Collect key shape information.
     n_X, num_features = X.shape
@@ -170,11 +404,34 @@ def get_data_general(dataset, paras, rg, directory, do_normalize=True,
     paras.update({"num_features": num_features,
                   "num_labels": num_labels})
     
-    ## Carry out shuffling if prescribed.
-    if do_shuffle:
+    ## Get the split as index arrays, if it is to be stored.
+    split = None
+    if split_name is not None:
+        split = load_split(toread=toread, name=split_name, n=n_all)
+        if split is None:
+            split = get_split_indices(n=n_all, paras=paras, rg=rg,
+                                      do_shuffle=do_shuffle)
+            save_split(toread=toread, name=split_name, split=split, n=n_all)
+        elif "train" not in split:
+            raise ValueError("Split {} has no training subset.".format(
+                split_name
+            ))
+    
+    ## Carry out shuffling if prescribed (in place, to save memory).
+    if split is not None:
+        idx_shuffled = np.concatenate([split[k] for k in ("train","val","test")
+                                       if k in split])
+    elif do_shuffle:
         idx_shuffled = rg.permutation(n_all)
-        X = X[idx_shuffled,:]
-        y = y[idx_shuffled,:] if y is not None else None
+    else:
+        idx_shuffled = None
+    if idx_shuffled is not None:
+        if issparse(X):
+            X = X[idx_shuffled] # copy, but only of the non-zeros.
+        else:
+            permute_rows(A=X, idx=idx_shuffled)
+        y = permute_rows(A=y, idx=idx_shuffled) if y is not None else None
+        del idx_shuffled
 
     ## Type-specific checks and modifications.
     if "type" in paras:
@@ -188,14 +445,42 @@ def get_data_general(dataset, paras, rg, directory, do_normalize=True,
         raise ValueError("All datasets must have a type parameter.")
 
     ## Normalize the inputs in a per-feature manner, if prescribed.
-    if do_normalize:
-        maxvec = X.max(axis=0,keepdims=True)
-        minvec = X.min(axis=0,keepdims=True)
-        X = X-minvec
-        with np.errstate(divide="ignore", invalid="ignore"):
-            X = X / (maxvec-minvec)
-            X[X == np.inf] = 0
-            X = np.nan_to_num(X)
+    ## Everything is done in place; features with zero range are
+    ## left as X-minvec, which is exactly zero for such features.
+    ## Sparse X is only scaled (by the per-feature maximum absolute
+    ## value), so that zeros stay zero.
+    ## Quantized X is left as is; normalization is done lazily.
+    ## Stored min/max are used if present (and of the right shape).
+    if do_normalize and not is_quantized:
+        minmax = get_minmax_stored(toread=toread, dtype=X.dtype, name="X")
+        if minmax is not None and minmax[0].shape[1] != num_features:
+            minmax = None
+    if is_quantized:
+        if do_normalize:
+            shift, scale = get_pixel_scaling(
+                X=X, paras=paras, scaling=pixel_scaling,
+                stats=get_stats(toread=toread, name="X")
+            )
+        else:
+            shift, scale = (None, None)
+    elif do_normalize and issparse(X):
+        if minmax is None:
+            maxvec = abs(X).max(axis=0).toarray().reshape(-1)
+        else:
+            maxvec = np.maximum(np.abs(minmax[0]),
+                                np.abs(minmax[1])).reshape(-1)
+        maxvec[maxvec == 0] = 1
+        X.data /= maxvec[X.indices]
+        del maxvec, minmax
+    elif do_normalize:
+        if minmax is None:
+            maxvec = X.max(axis=0,keepdims=True)
+            minvec = X.min(axis=0,keepdims=True)
+        else:
+            minvec, maxvec = minmax
+        np.subtract(X, minvec, out=X)
+        maxvec -= minvec # now the per-feature range.
+        np.divide(X, maxvec, out=X, where=(maxvec > 0))
         del maxvec, minvec
 
     ## Get split sizes (training, validation, testing).
@@ -204,8 +489,12 @@ def get_data_general(dataset, paras, rg, directory, do_normalize=True,
         print("n_all:", n_all,
               "num_features:", num_features,
               "num_labels:", num_labels)
-        n_train = int(n_all*paras["n_train_frac"])
-        n_val = int(n_all*paras["n_val_frac"])
+        if split is None:
+            n_train = int(n_all*paras["n_train_frac"])
+            n_val = int(n_all*paras["n_val_frac"])
+        else:
+            n_train = len(split["train"])
+            n_val = len(split["val"]) if "val" in split else 0
         n_test = n_all-n_train-n_val
         print("--Subset sizes--")
         print("n_train:", n_train,
@@ -226,6 +515,14 @@ def get_data_general(dataset, paras, rg, directory, do_normalize=True,
     X_test = X[(n_train+n_val):,:]
     y_test = y[(n_train+n_val):,:] if y is not None else None
 
+    ## Dequantizing handles over the quantized splits (no copies).
+    if is_quantized:
+        X_train, X_val, X_test = (
+            None if X_split is None else LazyArray(
+                source=X_split, dtype=dtype_X, shift=shift, scale=scale
+            ) for X_split in (X_train, X_val, X_test)
+        )
+
     ## For reference, print the data types.
     print("Data types:")
     print("X_train:", type(X_train),
@@ -235,6 +532,12 @@ def get_data_general(dataset, paras, rg, directory, do_normalize=True,
     print("X_test:", type(X_test),
           "y_test:", type(y_test))
     
+    ## Save to the cache if prescribed (dense data only).
+    if use_cache and not issparse(X):
+        cache.save(key=cache_key,
+                   splits=(X_train, y_train, X_val, y_val, X_test, y_test),
+                   paras=paras, rg=rg)
+    
     ## Return the split data, plus dataset paras.
     return (X_train, y_train, X_val, y_val, X_test, y_test, paras)
 
@@ -0,0 +1,210 @@
+'''Data: on-disk cache of preprocessed data splits.'''
+
+## External modules.
+import hashlib
+import json
+import numpy as np
+import os
+import shutil
+import tempfile
+import time
+
+## Internal modules.
+from mml.config import dir_data_cache, cache_max_bytes
+from mml.data.manifest import file_hash, get_output_hash
+from mml.utils import makedir_safe
+
+
+###############################################################################
+
+
+## For reference:
+## Each cache entry is a directory [dir_cache]/[key], where the key is
+## a hash of everything that determines the output of get_data_general,
+## namely the content of the dataset file, the state of the random
+## generator, the preprocessing flags, and the relevant dataset paras.
+## Each entry holds one .npy file per (non-None) array, plus meta.json.
+
+split_names = ["X_train", "y_train", "X_val", "y_val", "X_test", "y_test"]
+
+## Dataset paras which influence the preprocessed splits.
+_paras_keys = ["type", "num_classes", "label_col",
+               "n_train_frac", "n_val_frac"]
+
+_meta_name = "meta.json"
+_hashes_name = "file_hashes.json"
+
+
+def file_hash_cached(toread, dir_cache=dir_data_cache):
+    '''
+    Same as file_hash(), but remembers hashes in the cache
+    directory, keyed by path, size and modification time, so
+    an unchanged file is only ever read once. A file with a
+    (matching) manifest is never read in full, as its hash is
+    taken from there (see mml.data.manifest).
+    '''
+    h = get_output_hash(toread=toread)
+    if h is not None:
+        return h
+    st = os.stat(toread)
+    stamp = "{}|{}|{}".format(os.path.realpath(toread),
+                              st.st_size, st.st_mtime_ns)
+    path_hashes = os.path.join(dir_cache, _hashes_name)
+    try:
+        with open(path_hashes, mode="r") as f:
+            hashes = json.load(f)
+    except (OSError, ValueError):
+        hashes = {}
+    if stamp not in hashes:
+        hashes[stamp] = file_hash(toread=toread)
+        makedir_safe(dir_cache)
+        _write_json(path=path_hashes, obj=hashes)
+    return hashes[stamp]
+
+
+def get_key(toread, paras, rg, do_normalize, do_shuffle, do_onehot,
+            split_name=None, dir_cache=dir_data_cache):
+    '''
+    Cache key for the splits of the data in toread.
+    '''
+    key_dict = {
+        "file": file_hash_cached(toread=toread, dir_cache=dir_cache),
+        "rg": repr(rg.bit_generator.state) if do_shuffle else None,
+        "do_normalize": do_normalize,
+        "do_shuffle": do_shuffle,
+        "do_onehot": do_onehot,
+        "split_name": split_name,
+        "paras": {k: paras.get(k, None) for k in _paras_keys}
+    }
+    s = json.dumps(key_dict, sort_keys=True, default=str)
+    return hashlib.sha256(s.encode()).hexdigest()[0:32]
+
+
+def load(key, paras, rg, dir_cache=dir_data_cache):
+    '''
+    If the cache has an entry for key, return the tuple of
+    splits (in split_names order; None where absent) as
+    read-only memory-mapped arrays, after updating paras and
+    putting rg in the same state as if the splits had just
+    been computed. Otherwise return None.
+    '''
+    dir_entry = os.path.join(dir_cache, key)
+    try:
+        with open(os.path.join(dir_entry, _meta_name), mode="r") as f:
+            meta = json.load(f)
+        out = tuple(
+            np.load(os.path.join(dir_entry, name+".npy"), mmap_mode="r")
+            if name in meta["present"] else None for name in split_names
+        )
+    except (OSError, ValueError, KeyError):
+        return None
+
+    paras.update(meta["paras"])
+    if meta["rg_state"] is not None:
+        rg.bit_generator.state = meta["rg_state"]
+
+    ## Mark as recently used (for LRU eviction).
+    os.utime(dir_entry)
+    print("Loaded splits from cache ({}).".format(dir_entry))
+    return out
+
+
+def save(key, splits, paras, rg, dir_cache=dir_data_cache,
+         max_bytes=cache_max_bytes):
+    '''
+    Store the tuple of splits (in split_names order) under key,
+    and then evict old entries if the cache is too large.
+    The entry is written to a temporary directory and renamed
+    into place, so concurrent readers never see partial entries.
+    Nothing is cached if the state of rg cannot be stored as
+    JSON (e.g., for some legacy bit generators).
+    '''
+    makedir_safe(dir_cache)
+    dir_entry = os.path.join(dir_cache, key)
+    if os.path.exists(dir_entry):
+        return None
+
+    ## Check the metadata can be written before writing anything.
+    present = [name for name, A in zip(split_names, splits)
+               if A is not None]
+    meta = {"present": present,
+            "paras": {"num_features": paras["num_features"],
+                      "num_labels": paras["num_labels"]},
+            "rg_state": rg.bit_generator.state,
+            "time": time.time()}
+    try:
+        json.dumps(meta)
+    except (TypeError, ValueError):
+        print("Splits not cached (rg state is not JSON-compatible).")
+        return None
+
+    dir_tmp = tempfile.mkdtemp(prefix=".tmp_", dir=dir_cache)
+    try:
+        for name, A in zip(split_names, splits):
+            if A is not None:
+                np.save(os.path.join(dir_tmp, name+".npy"),
+                        np.ascontiguousarray(A))
+        _write_json(path=os.path.join(dir_tmp, _meta_name), obj=meta)
+        os.rename(dir_tmp, dir_entry)
+    except OSError:
+        ## Most likely another process just wrote the same entry.
+        return None
+    finally:
+        shutil.rmtree(dir_tmp, ignore_errors=True) # gone once renamed.
+
+    evict(max_bytes=max_bytes, dir_cache=dir_cache, keep=key)
+    return None
+
+
+def get_entries(dir_cache=dir_data_cache):
+    '''
+    List of (last used time, size in bytes, path) for all
+    cache entries, least recently used first.
+    '''
+    entries = []
+    if not os.path.isdir(dir_cache):
+        return entries
+    for name in os.listdir(dir_cache):
+        path = os.path.join(dir_cache, name)
+        if name.startswith(".") or not os.path.isdir(path):
+            continue
+        size = sum(os.path.getsize(os.path.join(path, fn))
+                   for fn in os.listdir(path))
+        entries.append((os.path.getmtime(path), size, path))
+    return sorted(entries)
+
+
+def evict(max_bytes=cache_max_bytes, dir_cache=dir_data_cache, keep=None):
+    '''
+    Remove least recently used entries until the total size
+    of the cache is at most max_bytes (never removing keep).
+    '''
+    entries = get_entries(dir_cache=dir_cache)
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in entries:
+        if total <= max_bytes:
+            break
+        if keep is not None and os.path.basename(path) == keep:
+            continue
+        shutil.rmtree(path, ignore_errors=True)
+        total -= size
+        print("Evicted cache entry ({}).".format(path))
+    return None
+
+
+def _write_json(path, obj):
+    '''
+    Write obj as JSON to path via an atomic rename.
+    '''
+    fd, path_tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, mode="w") as f:
+            json.dump(obj, f)
+        os.replace(path_tmp, path)
+    finally:
+        if os.path.exists(path_tmp):
+            os.remove(path_tmp)
+    return None
+
+
+###############################################################################
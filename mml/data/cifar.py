@@ -0,0 +1,62 @@
+'''Data: record reader for the CIFAR-10/100 binary format.'''
+
+## External modules.
+import numpy as np
+import os
+
+
+###############################################################################
+
+
+## For reference:
+## The binary versions of CIFAR-10 and CIFAR-100 are flat sequences of
+## fixed-length records. Each record is some label bytes followed by
+## 3072 pixel bytes (1024 each for the red, green, and blue channels,
+## each channel stored row-major over the 32x32 image).
+## - CIFAR-10: one label byte per record.
+## - CIFAR-100: two label bytes per record, coarse then fine.
+## Ref: https://www.cs.toronto.edu/~kriz/cifar.html
+
+num_pixels = 32*32*3
+
+
+def cifar_dtype(num_labels=1):
+    '''
+    Structured dtype describing a single CIFAR record,
+    with fields "labels" (shape (num_labels,)) and
+    "pixels" (shape (num_pixels,)).
+    '''
+    return np.dtype([("labels", np.uint8, (num_labels,)),
+                     ("pixels", np.uint8, (num_pixels,))])
+
+
+def read_cifar(toread, num_labels=1, n=None):
+    '''
+    Memory-map a CIFAR batch file as an array of records,
+    and return the pixel and label columns as a pair
+    (X, y) of read-only views, with shapes (n, num_pixels)
+    and (n, num_labels) respectively. No data is copied
+    until the caller actually reads from these views.
+    - n: if not None, the expected number of records.
+    '''
+    dtype = cifar_dtype(num_labels=num_labels)
+
+    size = os.path.getsize(toread)
+    if size % dtype.itemsize != 0:
+        raise ValueError(
+            "Size of {} ({} bytes) is not a multiple of {}.".format(
+                toread, size, dtype.itemsize
+            )
+        )
+    if n is not None and size // dtype.itemsize != n:
+        raise ValueError(
+            "{} has {} records; expected {}.".format(
+                toread, size // dtype.itemsize, n
+            )
+        )
+
+    records = np.memmap(toread, dtype=dtype, mode="r")
+    return (records["pixels"], records["labels"])
+
+
+###############################################################################
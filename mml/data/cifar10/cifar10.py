@@ -8,6 +8,9 @@ import tables
 ## Internal modules.
 from mml.config import dir_data_toread
 from mml.config import dir_data_towrite
+from mml.data.cifar import read_cifar
+from mml.data.h5write import append_blocks, check_counts, iter_blocks
+from mml.data.manifest import skip_if_fresh
 from mml.utils import makedir_safe
 
 
@@ -29,6 +32,7 @@ towrite = os.path.join(newdir, "cifar10.h5")
 
 n_tr_perbatch = 10000
 num_batches = 5
+toread_tr = [get_toread_tr(num=num) for num in range(num_batches)]
 n_tr = n_tr_perbatch*num_batches
 n_te = 10000
 n_all = n_tr+n_te
@@ -46,80 +50,37 @@ dtype_y = np.uint8
 atom_y = tables.UInt8Atom()
 
 
+@skip_if_fresh
 def raw_to_h5():
     '''
     Transform the raw dataset into one of HDF5 type.
     '''
     
-    X_raw_tr = np.zeros((n_tr,num_features), dtype=dtype_X)
-    X_raw_te = np.zeros((n_te,num_features), dtype=dtype_X)
-    y_raw_tr = np.zeros((n_tr,num_labels), dtype=dtype_y)
-    y_raw_te = np.zeros((n_te,num_labels), dtype=dtype_y)
-    
-    i_tr = 0
-    
     print("Preparation: {}".format(data_name))
     
-    ## Loop over batches, and populate *_raw_tr.
-    for num_batch in range(num_batches):
-        
-        toread = get_toread_tr(num=num_batch)
-        
-        with open(toread, mode="rb") as f_bin:
-        
-            print("Read {}.".format(toread))
-            
-            for i in range(n_tr_perbatch):
-                
-                if i_tr % 5000 == 0:
-                    print("(tr) Working... image {}.".format(i_tr))
-                
-                y_raw_tr[i_tr,0] = int.from_bytes(f_bin.read(1),
-                                                  byteorder="big",
-                                                  signed=False)
-                for j in range(num_features):
-                    X_raw_tr[i_tr,j] = int.from_bytes(f_bin.read(1),
-                                                      byteorder="big",
-                                                      signed=False)
-                i_tr += 1
-                
-                
-
-    ## Populate *_raw_te.
-    with open(toread_te, mode="rb") as f_bin:
-        
-        print("Read {}.".format(toread_te))
-        
-        for i in range(n_te):
-            
-            if i % 1000 == 0:
-                print("(te) Working... image {}.".format(i))
-            
-            y_raw_te[i,0] = int.from_bytes(f_bin.read(1),
-                                           byteorder="big",
-                                           signed=False)
-            for j in range(num_features):
-                X_raw_te[i,j] = int.from_bytes(f_bin.read(1),
-                                               byteorder="big",
-                                               signed=False)
+    ## Memory-map each batch; X/y are views into the files.
+    sources = []
+    for toread in toread_tr+[toread_te]:
+        print("Read {}.".format(toread))
+        X_raw, y_raw = read_cifar(toread=toread, num_labels=num_labels)
+        sources.append(iter_blocks(X=X_raw, y=y_raw))
     
-    ## Concatenate.
-    X_raw = np.vstack((X_raw_tr, X_raw_te))
-    y_raw = np.vstack((y_raw_tr, y_raw_te))
-    
-    ## Create and populate the HDF5 file.
+    ## Copy over to the HDF5 file, one block at a time.
     makedir_safe(newdir)
     with tables.open_file(towrite, mode="w", title=title) as myh5:
-        myh5.create_array(where=myh5.root,
-                          name="X",
-                          obj=X_raw,
-                          atom=atom_X,
-                          title=title_X)
-        myh5.create_array(where=myh5.root,
-                          name="y",
-                          obj=y_raw,
-                          atom=atom_y,
-                          title=title_y)
+        counts = append_blocks(myh5=myh5,
+                               sources=sources,
+                               atom_X=atom_X,
+                               atom_y=atom_y,
+                               title_X=title_X,
+                               title_y=title_y,
+                               expectedrows=n_all)
+        
+        ## Check that the number of instances is as expected.
+        check_counts(counts=counts,
+                     expected=[n_tr_perbatch]*num_batches+[n_te],
+                     names=["tr{}".format(num+1)
+                            for num in range(num_batches)]+["te"])
         print(myh5)
     
     print("Wrote {}.".format(towrite))
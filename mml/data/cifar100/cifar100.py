@@ -3,11 +3,15 @@
 ## External modules.
 import numpy as np
 import os
+import sys
 import tables
 
 ## Internal modules.
 from mml.config import dir_data_toread
 from mml.config import dir_data_towrite
+from mml.data.cifar import read_cifar
+from mml.data.h5write import append_blocks, check_counts, iter_blocks
+from mml.data.manifest import skip_if_fresh
 from mml.utils import makedir_safe
 
 
@@ -35,7 +39,12 @@ n_all = n_tr+n_te
 num_features = 32*32*3
 num_classes_coarse = 20
 num_classes_fine = 100
-num_labels = 2
+num_labels_raw = 2 # raw records are (coarse, fine).
+
+## Label columns (in raw record order) for each choice of label_type.
+label_cols = {"fine": [1],
+              "coarse": [0],
+              "both": [1,0]}
 
 title = data_name+": Full dataset"
 title_X = data_name+": Features"
@@ -47,79 +56,46 @@ dtype_y = np.uint8
 atom_y = tables.UInt8Atom()
 
 
-def raw_to_h5():
+@skip_if_fresh
+def raw_to_h5(label_type="both"):
     '''
     Transform the raw dataset into one of HDF5 type.
+    - label_type: which labels to store in y; one of the keys
+      of label_cols. The default of "both" stores the fine
+      labels in the first column, coarse in the second.
     '''
     
-    X_raw_tr = np.zeros((n_tr,num_features), dtype=dtype_X)
-    X_raw_te = np.zeros((n_te,num_features), dtype=dtype_X)
-    y_raw_tr = np.zeros((n_tr,num_labels), dtype=dtype_y)
-    y_raw_te = np.zeros((n_te,num_labels), dtype=dtype_y)
+    if label_type not in label_cols:
+        raise ValueError("label_type must be one of {}.".format(
+            list(label_cols.keys())
+        ))
     
     print("Preparation: {}".format(data_name))
     
-    ## Populate *_raw_tr.
-    with open(toread_tr, mode="rb") as f_bin:
-        
-        print("Read {}.".format(toread_tr))
-        
-        for i in range(n_tr):
-            
-            if i % 5000 == 0:
-                print("(tr) Working... image {}.".format(i))
-
-            ## Put coarse labels in second column, fine labels in first.
-            y_raw_tr[i,1] = int.from_bytes(f_bin.read(1),
-                                           byteorder="big",
-                                           signed=False)
-            y_raw_tr[i,0] = int.from_bytes(f_bin.read(1),
-                                           byteorder="big",
-                                           signed=False)
-            for j in range(num_features):
-                X_raw_tr[i,j] = int.from_bytes(f_bin.read(1),
-                                               byteorder="big",
-                                               signed=False)
-    
-    ## Populate *_raw_te.
-    with open(toread_te, mode="rb") as f_bin:
-        
-        print("Read {}.".format(toread_te))
-        
-        for i in range(n_te):
-            
-            if i % 1000 == 0:
-                print("(te) Working... image {}.".format(i))
-
-            ## Put coarse labels in second column, fine labels in first.
-            y_raw_te[i,1] = int.from_bytes(f_bin.read(1),
-                                           byteorder="big",
-                                           signed=False)
-            y_raw_te[i,0] = int.from_bytes(f_bin.read(1),
-                                           byteorder="big",
-                                           signed=False)
-            for j in range(num_features):
-                X_raw_te[i,j] = int.from_bytes(f_bin.read(1),
-                                               byteorder="big",
-                                               signed=False)
+    ## Memory-map the raw records, and copy over to the HDF5 file
+    ## one block at a time, keeping only the requested label column(s).
+    sources = []
+    for toread in [toread_tr, toread_te]:
+        print("Read {}.".format(toread))
+        X_raw, y_raw = read_cifar(toread=toread, num_labels=num_labels_raw)
+        sources.append(
+            (X_block, y_block[:,label_cols[label_type]])
+            for X_block, y_block in iter_blocks(X=X_raw, y=y_raw)
+        )
     
-    ## Concatenate.
-    X_raw = np.vstack((X_raw_tr, X_raw_te))
-    y_raw = np.vstack((y_raw_tr, y_raw_te))
-    
-    ## Create and populate the HDF5 file.
     makedir_safe(newdir)
     with tables.open_file(towrite, mode="w", title=title) as myh5:
-        myh5.create_array(where=myh5.root,
-                          name="X",
-                          obj=X_raw,
-                          atom=atom_X,
-                          title=title_X)
-        myh5.create_array(where=myh5.root,
-                          name="y",
-                          obj=y_raw,
-                          atom=atom_y,
-                          title=title_y)
+        counts = append_blocks(myh5=myh5,
+                               sources=sources,
+                               atom_X=atom_X,
+                               atom_y=atom_y,
+                               title_X=title_X,
+                               title_y=title_y,
+                               expectedrows=n_all)
+        
+        ## Check that the number of instances is as expected.
+        check_counts(counts=counts, expected=[n_tr, n_te],
+                     names=["tr", "te"])
         print(myh5)
     
     print("Wrote {}.".format(towrite))
@@ -130,7 +106,7 @@ def raw_to_h5():
 
 
 if __name__ == "__main__":
-    raw_to_h5()
+    raw_to_h5(*sys.argv[1:2]) # optionally pass label_type.
 
 
 ###############################################################################
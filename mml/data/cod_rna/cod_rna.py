@@ -1,7 +1,6 @@
 '''H5 data prep'''
 
 ## External modules.
-import csv
 import numpy as np
 import os
 import tables
@@ -9,6 +8,9 @@ import tables
 ## Internal modules.
 from mml.config import dir_data_toread
 from mml.config import dir_data_towrite
+from mml.data.h5write import check_counts
+from mml.data.libsvm import libsvm_to_h5
+from mml.data.manifest import skip_if_fresh
 from mml.utils import makedir_safe
 
 
@@ -59,126 +61,32 @@ atom_X = tables.Float32Atom()
 dtype_y = np.uint8
 atom_y = tables.UInt8Atom()
 
-def parse_line(x, y):
-
-    ## Inputs are a bit complicated.
-    x_out_list = []
-
-    for j in range(len(x)):
-        
-        value = x[j]
-        attribute = attribute_names[j]
-        num_distinct = len(attribute_dict[attribute])
-
-        if num_distinct != 1:
-            raise ValueError("Should only have one distinct value per attr.")
-        else:
-            wnum, numval = value.split(":")
-            x_out_list.append(np.array([numval], dtype=dtype_X))
-    
-    x_out = np.concatenate(x_out_list)
-    if len(x_out) != num_features:
-        raise ValueError("Something is wrong with the feature vec parser.")
-
-    ## Labels are easy.
-    y_out = np.array([label_dict[y]], dtype=dtype_y)
-
-    return x_out, y_out
-
-
+@skip_if_fresh
 def raw_to_h5():
     '''
     Transform the raw dataset into one of HDF5 type.
     '''
     
-    X_raw_tr = np.zeros((n_tr,num_features), dtype=dtype_X)
-    y_raw_tr = np.zeros((n_tr,num_labels), dtype=dtype_y)
-    X_raw_te = np.zeros((n_te,num_features), dtype=dtype_X)
-    y_raw_te = np.zeros((n_te,num_labels), dtype=dtype_y)
-    
     print("Preparation: {}".format(data_name))
     
-    ## Read in the raw training data.
-    with open(toread_tr, newline="") as f_table:
-
-        print("Read {}.".format(toread_tr))
-        
-        f_reader = csv.reader(f_table, delimiter=" ")
-        
-        ## Populate the placeholder numpy arrays.
-        idx = 0
-        for line in f_reader:
-
-            if len(line) == 0:
-                continue # do nothing for blank lines.
-
-            ## Numpy arrays for individual instance.
-            x, y = parse_line(x=line[1:], y=line[0])
-
-            if x is None:
-                continue # skip instances with missing values.
-            else:
-                X_raw_tr[idx,:] = x
-                y_raw_tr[idx,0] = y
-
-            ## Update the index (also counts the clean data points).
-            idx += 1
-        
-        ## Check that number of *clean* instances is as expected.
-        print(
-            "Number of clean guys (tr): {}. Note n_tr = {}".format(idx,n_tr)
-        )
-
-    
-    ## Read in the raw test data.
-    with open(toread_te, newline="") as f_table:
-
-        print("Read {}.".format(toread_te))
-        
-        f_reader = csv.reader(f_table, delimiter=" ")
-        
-        ## Populate the placeholder numpy arrays.
-        idx = 0
-        for i, line in enumerate(f_reader):
-            
-            if len(line) == 0:
-                continue # do nothing for blank lines.
-            
-            ## Numpy arrays for individual instance.
-            x, y = parse_line(x=line[1:], y=line[0])
-
-            if x is None:
-                continue # skip instances with missing values.
-            else:
-                X_raw_te[idx,:] = x
-                y_raw_te[idx,0] = y
-
-            ## Update the index (also counts the clean data points).
-            idx += 1
-        
-        ## Check that number of *clean* instances is as expected.
-        print(
-            "Number of clean guys (te): {}. Note n_te = {}".format(idx,n_te)
-        )
-    
-    
-    ## Concatenate.
-    X_raw = np.vstack((X_raw_tr, X_raw_te))
-    y_raw = np.vstack((y_raw_tr, y_raw_te))
-    
-    ## Create and populate the HDF5 file.
+    ## Stream the raw (LIBSVM format) training and test data into
+    ## the HDF5 file; there are few features, so store them densely.
     makedir_safe(newdir)
     with tables.open_file(towrite, mode="w", title=title) as myh5:
-        myh5.create_array(where=myh5.root,
-                          name="X",
-                          obj=X_raw,
-                          atom=atom_X,
-                          title=title_X)
-        myh5.create_array(where=myh5.root,
-                          name="y",
-                          obj=y_raw,
-                          atom=atom_y,
-                          title=title_y)
+        counts = libsvm_to_h5(toread=[toread_tr, toread_te],
+                              myh5=myh5,
+                              atom_X=atom_X,
+                              atom_y=atom_y,
+                              label_dict=label_dict,
+                              num_features=num_features,
+                              densify=True,
+                              title_X=title_X,
+                              title_y=title_y,
+                              expectedrows=n_all)
+        
+        ## Check that number of *clean* instances is as expected.
+        check_counts(counts=counts, expected=[n_tr, n_te],
+                     names=["tr", "te"])
         print(myh5)
 
     print("Wrote {}.".format(towrite))
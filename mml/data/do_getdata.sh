@@ -1,10 +1,22 @@
 #!/bin/bash
 
-## Loop over arguments passed.
+## Loop over arguments passed, downloading (and expanding) raw data,
+## unless the HDF5 file is already up to date (see mml/data/manifest.py).
 
 for arg
 do
-    echo "Doing: $arg dataset."
-    bash "./$arg/getdata.sh" -x
-    python "./$arg/$arg.py"
+    if python -m mml.data.manifest "$arg" > /dev/null
+    then
+        echo "Skipping: $arg dataset (up to date)."
+    else
+        echo "Doing: $arg dataset."
+        bash "./$arg/getdata.sh" -x
+    fi
 done
+
+## Convert all the raw data to HDF5, in parallel.
+
+if [ "$#" -gt 0 ]
+then
+    python -m mml.data.prepare "$@"
+fi
@@ -0,0 +1,208 @@
+'''Data: helpers for writing arrays to HDF5 in a standard layout.'''
+
+## External modules.
+import numpy as np
+import tables
+
+## Internal modules.
+from mml.config import h5_complib, h5_complevel, h5_shuffle, h5_chunk_bytes
+from mml.data.stats import RunningStats, compute_stats
+
+
+###############################################################################
+
+
+def get_filters(complib=h5_complib, complevel=h5_complevel,
+                shuffle=h5_shuffle):
+    '''
+    Filters (i.e., compression settings) for new HDF5 nodes.
+    Returns None when compression is switched off.
+    '''
+    if complevel == 0:
+        return None
+    else:
+        return tables.Filters(complib=complib, complevel=complevel,
+                              shuffle=shuffle)
+
+
+def get_chunkshape(shape, atom, chunk_rows=None,
+                   chunk_bytes=h5_chunk_bytes):
+    '''
+    Row-block oriented chunk shape for an array of the
+    given shape; each chunk holds a contiguous block of
+    complete rows, so reading any row range only touches
+    the chunks overlapping that range.
+    - chunk_rows: number of rows per chunk; if None, this
+      is set such that chunks are roughly chunk_bytes in size.
+    '''
+    n = shape[0]
+    row_bytes = atom.itemsize * int(np.prod(shape[1:]))
+    if chunk_rows is None:
+        chunk_rows = chunk_bytes // max(row_bytes,1)
+    chunk_rows = int(min(max(chunk_rows,1), max(n,1)))
+    return (chunk_rows,) + tuple(shape[1:])
+
+
+def create_carray(myh5, name, obj, atom, title="", where=None,
+                  chunk_rows=None, filters="default", stats=True):
+    '''
+    Create a chunked (and by default compressed) array
+    node from obj, and populate it. This is a drop-in
+    replacement for myh5.create_array(), with defaults
+    taken from the h5_* settings in mml.config.
+    - chunk_rows: rows per chunk (see get_chunkshape).
+    - filters: a tables.Filters object, None for no
+      compression, or "default" for get_filters().
+    - stats: if True, store per-column statistics as node
+      attributes (see mml.data.stats); for integer labels
+      (a node named "y"), class counts are stored too.
+    '''
+    if where is None:
+        where = myh5.root
+    if isinstance(filters, str) and filters == "default":
+        filters = get_filters()
+
+    obj = np.asarray(obj)
+    node = myh5.create_carray(
+        where=where, name=name, atom=atom, shape=obj.shape,
+        title=title, filters=filters,
+        chunkshape=get_chunkshape(shape=obj.shape, atom=atom,
+                                  chunk_rows=chunk_rows)
+    )
+    node[...] = obj
+    if stats and obj.ndim >= 1:
+        compute_stats(
+            obj=obj,
+            count_values=(name == "y" and np.issubdtype(obj.dtype, np.integer))
+        ).to_node(node=node)
+    return node
+
+
+def create_earray(myh5, name, atom, shape_tail=(), title="", where=None,
+                  expectedrows=None, chunk_rows=None, filters="default"):
+    '''
+    Create an empty extendable array node, to be filled by
+    appending blocks of rows (with node.append()), for data
+    that is written piece by piece. Chunking and compression
+    follow the same defaults as create_carray(). Statistics
+    can be kept by passing each block to a RunningStats
+    object (see mml.data.stats), and stored at the end.
+    - shape_tail: shape of each row (e.g., (num_features,)).
+    - expectedrows: rough final number of rows, if known.
+    '''
+    if where is None:
+        where = myh5.root
+    if isinstance(filters, str) and filters == "default":
+        filters = get_filters()
+
+    shape_tail = tuple(shape_tail)
+    n_hint = 2**62 if expectedrows is None else expectedrows
+    node = myh5.create_earray(
+        where=where, name=name, atom=atom, shape=(0,)+shape_tail,
+        title=title, filters=filters,
+        expectedrows=1000 if expectedrows is None else expectedrows,
+        chunkshape=get_chunkshape(shape=(n_hint,)+shape_tail, atom=atom,
+                                  chunk_rows=chunk_rows)
+    )
+    return node
+
+
+def iter_blocks(X, y=None, block_bytes=2**24):
+    '''
+    Generator over aligned row blocks (X_block, y_block) of the
+    arrays X and y (y can be None), each block of X being about
+    block_bytes bytes. With memory-mapped X and y (e.g., from
+    read_idx or read_cifar), only one block is in memory at once.
+    '''
+    if y is not None and len(X) != len(y):
+        raise ValueError(
+            "len(X) {} != len(y) {}".format(len(X), len(y))
+        )
+    row_bytes = X.dtype.itemsize * int(np.prod(X.shape[1:]))
+    block_rows = max(1, block_bytes // max(row_bytes,1))
+    for start in range(0, len(X), block_rows):
+        stop = start + block_rows
+        yield (X[start:stop], None if y is None else y[start:stop])
+
+
+def append_blocks(myh5, sources, atom_X, atom_y=None,
+                  title_X="", title_y="", expectedrows=None):
+    '''
+    Write data given as blocks of rows into new extendable nodes
+    "X" and "y" of the open HDF5 file myh5, one block at a time,
+    so memory use is bounded by the block size rather than the
+    dataset size. Row shapes are taken from the first block, and
+    statistics (see mml.data.stats) are kept along the way.
+    - sources: list of iterables (e.g., one per raw file), each
+      yielding pairs (X_block, y_block); y_block is None when
+      there are no labels, in which case atom_y is not used.
+    - expectedrows: rough total number of rows, if known.
+    Returns a list of the number of rows read from each source,
+    to be checked with check_counts().
+    '''
+    nodes = None
+    counts = []
+    for source in sources:
+        count = 0
+        for X_block, y_block in source:
+            if nodes is None:
+                nodes = [create_earray(myh5=myh5, name="X", atom=atom_X,
+                                       shape_tail=X_block.shape[1:],
+                                       title=title_X,
+                                       expectedrows=expectedrows)]
+                stats = [RunningStats()]
+                if y_block is not None:
+                    nodes.append(create_earray(
+                        myh5=myh5, name="y", atom=atom_y,
+                        shape_tail=y_block.shape[1:], title=title_y,
+                        expectedrows=expectedrows
+                    ))
+                    stats.append(RunningStats(count_values=np.issubdtype(
+                        atom_y.dtype, np.integer
+                    )))
+            blocks = (X_block,) if y_block is None else (X_block, y_block)
+            if len(blocks) != len(nodes):
+                raise ValueError("Labels must be given for all or no blocks.")
+            for node, stats_node, block in zip(nodes, stats, blocks):
+                block = np.asarray(block, dtype=node.atom.dtype)
+                node.append(block)
+                stats_node.update(block)
+            count += len(X_block)
+        counts.append(count)
+    if nodes is None:
+        raise ValueError("No data to write.")
+    for node, stats_node in zip(nodes, stats):
+        stats_node.to_node(node=node)
+    return counts
+
+
+def check_counts(counts, expected, names=None):
+    '''
+    Validate the number of rows read from each source (as
+    returned by append_blocks()) against the expected numbers,
+    printing both, and raising a ValueError on any mismatch.
+    - names: labels for the sources (e.g., "tr", "te").
+    '''
+    if names is None:
+        names = [str(i) for i in range(len(expected))]
+    if len(counts) != len(expected):
+        raise ValueError("Read {} sources; expected {}.".format(
+            len(counts), len(expected)
+        ))
+    mismatched = []
+    for name, count, count_expected in zip(names, counts, expected):
+        print("Number of clean guys ({}): {}. Expected {}.".format(
+            name, count, count_expected
+        ))
+        if count != count_expected:
+            mismatched.append(name)
+    if len(mismatched) > 0:
+        raise ValueError(
+            "Row counts differ from those expected for {}.".format(
+                mismatched
+            )
+        )
+    return None
+
+
+###############################################################################
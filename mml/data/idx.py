@@ -0,0 +1,100 @@
+'''Data: bulk reader for raw files in the IDX binary format.'''
+
+## External modules.
+import numpy as np
+import os
+
+
+###############################################################################
+
+
+## For reference:
+## An IDX file starts with a four-byte "magic number", whose first two
+## bytes are zero, third byte encodes the data type, and fourth byte
+## gives the number of dimensions. This is followed by one big-endian
+## unsigned 32-bit integer for the size of each dimension, and then
+## the data itself, stored in C order. This is the format used by
+## MNIST, Fashion-MNIST, and EMNIST.
+## Ref: http://yann.lecun.com/exdb/mnist/
+
+idx_dtypes = {0x08: np.dtype(np.uint8),
+              0x09: np.dtype(np.int8),
+              0x0B: np.dtype(">i2"),
+              0x0C: np.dtype(">i4"),
+              0x0D: np.dtype(">f4"),
+              0x0E: np.dtype(">f8")}
+
+
+def read_idx_header(f_bin):
+    '''
+    Read the header of an IDX file from an open binary file
+    object, leaving the file position at the start of the data.
+    Returns the dtype of the data and a tuple of dimensions.
+    '''
+    magic = f_bin.read(4)
+    if len(magic) != 4 or magic[0] != 0 or magic[1] != 0:
+        raise ValueError("Not an IDX file (bad magic number).")
+
+    type_code, ndim = magic[2], magic[3]
+    if type_code not in idx_dtypes:
+        raise ValueError("Unknown IDX type code {}.".format(type_code))
+
+    dims_raw = f_bin.read(4*ndim)
+    if len(dims_raw) != 4*ndim:
+        raise ValueError("IDX header is truncated.")
+    dims = tuple(int(d) for d in np.frombuffer(dims_raw, dtype=">u4"))
+
+    return idx_dtypes[type_code], dims
+
+
+def read_idx(toread, dims=None, flatten=True, mmap=False):
+    '''
+    Read an entire IDX file in one shot.
+    - toread: path to the (uncompressed) IDX file.
+    - dims: if not None, the expected dimensions, checked
+      against those specified in the file header.
+    - flatten: if True, the output has shape (dims[0], -1),
+      i.e., one row per instance (labels become (n,1)).
+    - mmap: if True, return a read-only memory-mapped view
+      of the file rather than reading it into memory.
+    Returns an ndarray using the native byte order whenever
+    this can be done without a copy (always true for uint8).
+    '''
+
+    with open(toread, mode="rb") as f_bin:
+
+        dtype, dims_file = read_idx_header(f_bin=f_bin)
+        offset = f_bin.tell()
+
+        if dims is not None and tuple(dims) != dims_file:
+            raise ValueError(
+                "IDX dims are {}; expected {}.".format(dims_file, tuple(dims))
+            )
+
+        ## Check the file size before reading anything.
+        count = int(np.prod(dims_file))
+        size_expected = offset + count*dtype.itemsize
+        size_actual = os.fstat(f_bin.fileno()).st_size
+        if size_actual != size_expected:
+            raise ValueError(
+                "IDX file has {} bytes; header implies {}.".format(
+                    size_actual, size_expected
+                )
+            )
+
+        if mmap:
+            out = np.memmap(toread, dtype=dtype, mode="r",
+                            offset=offset, shape=dims_file)
+        else:
+            out = np.fromfile(f_bin, dtype=dtype, count=count)
+            out = out.reshape(dims_file)
+            if not out.dtype.isnative:
+                out = out.astype(out.dtype.newbyteorder("="))
+
+    if flatten:
+        out = out.reshape((dims_file[0],-1))
+
+    return out
+
+
+###############################################################################
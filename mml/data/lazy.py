@@ -0,0 +1,316 @@
+'''Data: lazy, array-like access to stored datasets.'''
+
+## External modules.
+import numpy as np
+import os
+from tables import open_file
+import weakref
+
+
+###############################################################################
+
+
+class LazyArray:
+    '''
+    A read-only, array-like handle over stored data, namely
+    either an HDF5 array node or an ndarray (typically a
+    memory-mapped .npy file). Nothing is read until the
+    handle is indexed, and only the rows that are actually
+    touched get read and converted to the target dtype.
+
+    Indexing supports everything that ndarray supports for
+    the first axis (integers, slices, integer arrays with
+    arbitrary order and repeats, boolean masks), optionally
+    followed by an index for the remaining axes, e.g.,
+    >> X_lazy[idx_batch,:]
+    always returns an ndarray of the target dtype.
+
+    Rows can also be dequantized on the fly, as (x-shift)/scale,
+    e.g., to keep uint8 images in memory but see float32 rows.
+    Products X_lazy @ w (and X_lazy.T @ C, via transpose_matmul)
+    are computed one block of rows at a time, so a forward pass
+    (or reduced gradient) never converts all rows at once.
+    '''
+
+    def __init__(self, source, dtype=None, name="X", cols=None,
+                 block_bytes=2**20, shift=None, scale=None):
+        '''
+        - source: path to an HDF5 file (then name gives the
+          node under root), or any ndarray-like object.
+        - dtype: target dtype; if None, keep the stored dtype.
+        - cols: if not None, a slice of the second axis that
+          restricts which columns are visible (e.g., labels).
+        - block_bytes: approximate size of the row blocks
+          read from HDF5 when gathering arbitrary rows.
+        - shift, scale: if not None, per-feature arrays (one
+          value per column) applied after conversion; features
+          with scale 0 are only shifted. Needs a float dtype.
+        '''
+        if isinstance(source, str):
+            self._h5 = open_file(source, mode="r")
+            self._finalizer = weakref.finalize(self, self._h5.close)
+            self._data = self._h5.get_node(where=self._h5.root, name=name)
+        else:
+            self._h5 = None
+            self._finalizer = None
+            self._data = source
+
+        self._cols = cols
+        self.shape = tuple(int(s) for s in self._data.shape)
+        if cols is not None:
+            num_cols = len(range(*cols.indices(self.shape[1])))
+            self.shape = (self.shape[0], num_cols) + self.shape[2:]
+        self.ndim = len(self.shape)
+        self.dtype = np.dtype(self._data.dtype if dtype is None else dtype)
+
+        ## Per-feature dequantization (if any).
+        self._shift = None if shift is None else (
+            np.asarray(shift, dtype=self.dtype).reshape(self.shape[1:])
+        )
+        self._scale = None if scale is None else (
+            np.asarray(scale, dtype=self.dtype).reshape(self.shape[1:])
+        )
+
+        ## Number of rows per block when gathering from HDF5.
+        chunkshape = getattr(self._data, "chunkshape", None)
+        row_bytes = self._data.dtype.itemsize * int(
+            np.prod(self._data.shape[1:])
+        )
+        self.block_rows = max(1, block_bytes // max(row_bytes,1))
+        if chunkshape is not None:
+            ## Align blocks with chunks to avoid decompressing twice.
+            self.block_rows = max(
+                chunkshape[0],
+                self.block_rows - self.block_rows % chunkshape[0]
+            )
+        return None
+
+
+    def __len__(self):
+        return self.shape[0]
+
+
+    def __repr__(self):
+        return "LazyArray(shape={}, dtype={})".format(self.shape, self.dtype)
+
+
+    def __array__(self, dtype=None, copy=None):
+        out = self.read()
+        return out if dtype is None else out.astype(dtype, copy=False)
+
+
+    def __getitem__(self, key):
+
+        ## Split into the row key and the key for remaining axes.
+        if isinstance(key, tuple):
+            key_rows, key_rest = (key[0], key[1:]) if len(key) > 0 else (
+                slice(None), ()
+            )
+        else:
+            key_rows, key_rest = (key, ())
+        if key_rows is Ellipsis:
+            key_rows, key_rest = (slice(None), (Ellipsis,)+key_rest)
+
+        ## Read the relevant rows, in their stored dtype.
+        if self._h5 is None:
+            rows = self._data[key_rows]
+        elif isinstance(key_rows, (slice, int, np.integer)):
+            rows = self._data[key_rows]
+        else:
+            rows = self._gather(key_rows)
+
+        ## Only then do any conversion, and apply remaining keys.
+        rows = np.asarray(rows)
+        if self._cols is not None:
+            if isinstance(key_rows, (int, np.integer)):
+                rows = rows[self._cols] # row axis was dropped.
+            else:
+                rows = rows[:,self._cols]
+        rows = self._convert(rows)
+        return rows[(Ellipsis,)+key_rest] if key_rest else rows
+
+
+    def __matmul__(self, other):
+        '''
+        Matrix product self @ other, one block of rows at a time.
+        '''
+        other = np.asarray(other)
+        out = None
+        for start in range(0, self.shape[0], self.block_rows):
+            out_block = self[start:(start+self.block_rows)] @ other
+            if out is None:
+                out = np.empty((self.shape[0],)+out_block.shape[1:],
+                               dtype=out_block.dtype)
+            out[start:(start+len(out_block))] = out_block
+        if out is None:
+            out = np.empty((0,)+other.shape[1:],
+                           dtype=np.result_type(self.dtype, other.dtype))
+        return out
+
+
+    def transpose_matmul(self, other):
+        '''
+        Matrix product self.T @ other, for other with one row
+        per row of self, summed over one block of rows at a time.
+        '''
+        other = np.asarray(other)
+        out = None
+        for start in range(0, self.shape[0], self.block_rows):
+            stop = start + self.block_rows
+            out_block = self[start:stop].T @ other[start:stop]
+            if out is None:
+                out = out_block
+            else:
+                out += out_block
+        if out is None:
+            out = np.zeros(self.shape[1:]+other.shape[1:],
+                           dtype=np.result_type(self.dtype, other.dtype))
+        return out
+
+
+    def _convert(self, rows):
+        '''
+        Convert rows (as read) to the target dtype, and
+        dequantize them if prescribed.
+        '''
+        if self._shift is None and self._scale is None:
+            return rows.astype(self.dtype, copy=False)
+        rows = rows.astype(self.dtype, copy=True) # never touch the source.
+        if self._shift is not None:
+            rows -= self._shift
+        if self._scale is not None:
+            np.divide(rows, self._scale, out=rows, where=(self._scale > 0))
+        return rows
+
+
+    def _gather(self, key_rows):
+        '''
+        Read an arbitrary set of rows from an HDF5 node, by
+        reading only those row blocks that contain rows of
+        interest. This avoids both point selection (which is
+        slow and does not allow repeats) and a full read.
+        '''
+        idx = np.asarray(key_rows)
+        if idx.dtype == bool:
+            if idx.shape != (self.shape[0],):
+                raise IndexError("Boolean mask must have shape (n,).")
+            idx = np.flatnonzero(idx)
+        idx = np.where(idx < 0, idx+self.shape[0], idx).astype(np.int64)
+        if idx.size > 0 and (idx.min() < 0 or idx.max() >= self.shape[0]):
+            raise IndexError("Row index out of bounds.")
+
+        idx_unique, inverse = np.unique(idx.reshape(-1), return_inverse=True)
+        out = np.empty((len(idx_unique),)+tuple(self._data.shape[1:]),
+                       dtype=self._data.dtype)
+
+        ## Group the sorted unique rows by block, and read block-wise.
+        blocks = idx_unique // self.block_rows
+        splits = np.flatnonzero(np.diff(blocks)) + 1
+        for pos in np.split(np.arange(len(idx_unique)), splits):
+            if len(pos) == 0:
+                continue
+            low = idx_unique[pos[0]]
+            high = idx_unique[pos[-1]] + 1
+            out[pos] = self._data[low:high][idx_unique[pos]-low]
+
+        return out[inverse].reshape(idx.shape+out.shape[1:])
+
+
+    def read(self):
+        '''
+        Read everything, returning an ndarray of target dtype.
+        '''
+        return self[:]
+
+
+    def close(self):
+        '''
+        Close the underlying HDF5 file (if any).
+        '''
+        if self._finalizer is not None:
+            self._finalizer()
+        return None
+
+
+    def in_memory_parts(self):
+        '''
+        For a handle over an in-memory array (not HDF5, and with
+        all columns visible), the dict of keyword arguments from
+        which an equivalent handle can be made; None otherwise.
+        '''
+        if self._h5 is not None or self._cols is not None:
+            return None
+        return {"source": self._data, "dtype": self.dtype,
+                "shift": self._shift, "scale": self._scale}
+
+
+def get_sidecar_path(toread, name):
+    '''
+    Path of the .npy sidecar holding node "name" of the
+    HDF5 file toread, e.g., mnist/mnist.h5 -> mnist/mnist_X.npy.
+    '''
+    return "{}_{}.npy".format(os.path.splitext(toread)[0], name)
+
+
+def write_sidecar(toread, name, dtype=None, block_bytes=2**24):
+    '''
+    Write node "name" of the HDF5 file toread to its .npy
+    sidecar, as a C-contiguous array of the given dtype (if
+    None, the stored one), one block of rows at a time. The
+    data in a .npy file starts at a 64-byte aligned offset,
+    so a memory map of it is aligned too. The file is written
+    under a temporary name and then renamed, so readers never
+    see a partial sidecar.
+    '''
+    towrite = get_sidecar_path(toread=toread, name=name)
+    towrite_tmp = towrite + ".tmp.npy"
+    with open_file(toread, mode="r") as f:
+        node = f.get_node(where=f.root, name=name)
+        dtype = np.dtype(node.dtype if dtype is None else dtype)
+        shape = tuple(int(s) for s in node.shape)
+        row_bytes = max(1, dtype.itemsize*int(np.prod(shape[1:])))
+        block_rows = max(1, block_bytes // row_bytes)
+        out = np.lib.format.open_memmap(towrite_tmp, mode="w+",
+                                        dtype=dtype, shape=shape)
+        for start in range(0, shape[0], block_rows):
+            out[start:(start+block_rows)] = node[start:(start+block_rows)]
+        out.flush()
+        del out
+    os.replace(towrite_tmp, towrite)
+    print("Wrote {}.".format(towrite))
+    return None
+
+
+def load_sidecar(toread, name, mmap_mode="r", shape=None):
+    '''
+    Memory-map the .npy sidecar of node "name" of the HDF5 file
+    toread, if there is one that is at least as new as toread
+    (and has the given shape, if not None); None otherwise.
+    Mapping is close to free, and processes mapping the same
+    file share the same physical pages (page cache).
+    '''
+    toread_npy = get_sidecar_path(toread=toread, name=name)
+    try:
+        if os.stat(toread_npy).st_mtime_ns < os.stat(toread).st_mtime_ns:
+            return None # stale; toread was rewritten since.
+    except OSError:
+        return None
+    out = np.load(toread_npy, mmap_mode=mmap_mode)
+    if shape is not None and tuple(out.shape) != tuple(shape):
+        return None
+    return out
+
+
+def get_lazy(toread, name, dtype=None, cols=None):
+    '''
+    Get a LazyArray for node "name" of the HDF5 file toread,
+    preferring a memory-mapped .npy sidecar whenever an
+    up-to-date one exists.
+    '''
+    source = load_sidecar(toread=toread, name=name, mmap_mode="r")
+    if source is None:
+        source = toread
+    return LazyArray(source=source, dtype=dtype, name=name, cols=cols)
+
+
+###############################################################################
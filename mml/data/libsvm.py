@@ -0,0 +1,240 @@
+'''Data: chunked reader for the LIBSVM (SVMlight) sparse text format.'''
+
+## External modules.
+import numpy as np
+from scipy.sparse import csr_matrix
+import tables
+
+## Internal modules.
+from mml.data.h5write import create_earray
+from mml.data.stats import RunningStats
+from mml.data.tabular import encode_labels
+
+
+###############################################################################
+
+
+## For reference:
+## Each line of a LIBSVM file reads
+##   <label> <index>:<value> <index>:<value> ...
+## where only the non-zero features are listed (so rows can have any
+## number of entries), and indices are 1-based by default. Anything
+## after a "#" is a comment. Sparse data is stored in HDF5 as a group
+## holding the CSR components "data", "indices" and "indptr" (each an
+## extendable array), with attributes format="csr" and shape=(n,d).
+
+
+def read_chunks(toread, chunk_bytes=2**24):
+    '''
+    Generator over blocks of roughly chunk_bytes bytes of
+    the file toread, each ending on a line boundary.
+    '''
+    with open(toread, mode="rb") as f:
+        left = b""
+        while True:
+            block = f.read(chunk_bytes)
+            if len(block) == 0:
+                break
+            block = left + block
+            cut = block.rfind(b"\n") + 1
+            left = block[cut:]
+            if cut > 0:
+                yield block[:cut]
+        if len(left.strip()) > 0:
+            yield left
+
+
+def parse_chunk(chunk, zero_based=False):
+    '''
+    Parse a block of complete LIBSVM lines (bytes) into the
+    tuple (labels, indptr, indices, data), where labels is an
+    array of strings, and the rest are the CSR components of
+    the features. Blank lines and comments are skipped. All
+    index:value pairs are converted by one bulk NumPy parse.
+    '''
+    if b"#" in chunk:
+        chunk = b"\n".join(line.partition(b"#")[0]
+                           for line in chunk.splitlines())
+
+    labels = []
+    pairs = []
+    for line in chunk.splitlines():
+        parts = line.split(None, 1)
+        if len(parts) == 0:
+            continue # do nothing for blank lines.
+        labels.append(parts[0])
+        pairs.append(parts[1] if len(parts) > 1 else b"")
+
+    nnz = np.array([p.count(b":") for p in pairs], dtype=np.int64)
+    indptr = np.zeros(len(pairs)+1, dtype=np.int64)
+    np.cumsum(nnz, out=indptr[1:])
+
+    try:
+        values = np.array(b" ".join(pairs).replace(b":", b" ").split(),
+                          dtype=np.float64)
+    except ValueError:
+        values = None
+    if values is None or len(values) != 2*indptr[-1]:
+        raise ValueError("Malformed index:value pairs in LIBSVM data.")
+
+    indices = values[0::2].astype(np.int64)
+    if not zero_based:
+        indices -= 1
+    if len(indices) > 0 and indices.min() < 0:
+        raise ValueError("Negative feature index in LIBSVM data.")
+
+    labels = np.array(labels).astype(str)
+    return (labels, indptr, indices, values[1::2])
+
+
+def load_libsvm(toread, label_dict=None, num_features=None,
+                zero_based=False, densify=False,
+                dtype_X=np.float32, dtype_y=np.uint8, chunk_bytes=2**24):
+    '''
+    Read a LIBSVM file into memory, returning (X, y), where
+    X is a scipy.sparse CSR matrix (or an ndarray if densify
+    is True), and y has shape (n,1).
+    - label_dict: maps raw label strings to integers; if None,
+      labels are read as numbers (e.g., for regression).
+    - num_features: if None, inferred from the largest index.
+    '''
+    labels = [np.zeros(0, dtype=str)]
+    indptr = [np.zeros(1, dtype=np.int64)]
+    indices = [np.zeros(0, dtype=np.int64)]
+    data = [np.zeros(0, dtype=dtype_X)]
+    nnz = 0
+    for chunk in read_chunks(toread=toread, chunk_bytes=chunk_bytes):
+        c_labels, c_indptr, c_indices, c_data = parse_chunk(
+            chunk=chunk, zero_based=zero_based
+        )
+        labels.append(c_labels)
+        indptr.append(c_indptr[1:]+nnz)
+        indices.append(c_indices)
+        data.append(c_data.astype(dtype_X))
+        nnz += c_indptr[-1]
+
+    indptr = np.concatenate(indptr)
+    indices = np.concatenate(indices)
+    num_features = check_num_features(indices=indices,
+                                      num_features=num_features)
+    X = csr_matrix((np.concatenate(data), indices, indptr),
+                   shape=(len(indptr)-1, num_features))
+    y = encode_labels(labels=np.concatenate(labels), label_dict=label_dict,
+                      dtype_y=dtype_y)
+    return (X.toarray() if densify else X, y)
+
+
+def check_num_features(indices, num_features=None):
+    '''
+    Number of features implied by the (0-based) indices, checked
+    against num_features when the latter is given.
+    '''
+    num_seen = int(indices.max())+1 if len(indices) > 0 else 0
+    if num_features is None:
+        return num_seen
+    elif num_seen > num_features:
+        raise ValueError("Feature index {} out of range ({}).".format(
+            num_seen-1, num_features
+        ))
+    else:
+        return num_features
+
+
+def libsvm_to_h5(toread, myh5, atom_X, atom_y, label_dict=None,
+                 num_features=None, zero_based=False, densify=False,
+                 title_X="", title_y="", expectedrows=None,
+                 chunk_bytes=2**24):
+    '''
+    Stream one or more LIBSVM files (toread is a path or list
+    of paths, read in order) into the open HDF5 file myh5, one
+    chunk at a time, so memory use does not depend on file
+    size. Labels go to the node "y", and features to "X".
+    - densify: if True, X is written as a dense (n, num_features)
+      array; only sensible when the number of features is small,
+      and num_features must then be given. Otherwise, X is a
+      CSR group (see above).
+    Returns a list of the number of rows read from each file.
+    '''
+    if isinstance(toread, str):
+        toread = [toread]
+    if densify and num_features is None:
+        raise ValueError("Densifying requires num_features.")
+
+    y_node = create_earray(myh5=myh5, name="y", atom=atom_y,
+                           shape_tail=(1,), title=title_y,
+                           expectedrows=expectedrows)
+    if densify:
+        X_node = create_earray(myh5=myh5, name="X", atom=atom_X,
+                               shape_tail=(num_features,), title=title_X,
+                               expectedrows=expectedrows)
+    else:
+        X_node = myh5.create_group(where=myh5.root, name="X", title=title_X)
+        data_node = create_earray(myh5=myh5, name="data", atom=atom_X,
+                                  where=X_node)
+        indices_node = create_earray(myh5=myh5, name="indices",
+                                     atom=tables.Int64Atom(), where=X_node)
+        indptr_node = create_earray(myh5=myh5, name="indptr",
+                                    atom=tables.Int64Atom(), where=X_node)
+        indptr_node.append(np.zeros(1, dtype=np.int64))
+
+    counts = []
+    nnz = 0
+    num_seen = 0
+    stats_X = RunningStats()
+    stats_y = RunningStats(count_values=(label_dict is not None))
+    for path in toread:
+        print("Read {}.".format(path))
+        count = 0
+        for chunk in read_chunks(toread=path, chunk_bytes=chunk_bytes):
+            labels, indptr, indices, data = parse_chunk(
+                chunk=chunk, zero_based=zero_based
+            )
+            num_seen = max(num_seen, check_num_features(
+                indices=indices, num_features=num_features
+            ))
+            y_chunk = encode_labels(labels=labels, label_dict=label_dict,
+                                    dtype_y=atom_y.dtype)
+            X_chunk = csr_matrix((data.astype(atom_X.dtype), indices, indptr),
+                                 shape=(len(labels), num_seen))
+            y_node.append(y_chunk)
+            stats_y.update(y_chunk)
+            stats_X.update(X_chunk)
+            if densify:
+                X_node.append(X_chunk.toarray())
+            else:
+                data_node.append(data.astype(atom_X.dtype))
+                indices_node.append(indices)
+                indptr_node.append(indptr[1:]+nnz)
+            nnz += indptr[-1]
+            count += len(labels)
+        counts.append(count)
+
+    if not densify:
+        X_node._v_attrs["format"] = "csr"
+        X_node._v_attrs["shape"] = (sum(counts), num_seen)
+    stats_X.update(csr_matrix((0, num_seen))) # final width, if sparse.
+    stats_X.to_node(node=X_node)
+    stats_y.to_node(node=y_node)
+    return counts
+
+
+def is_csr(node):
+    '''
+    True if the HDF5 node is a group holding a CSR matrix.
+    '''
+    return isinstance(node, tables.Group) and (
+        "format" in node._v_attrs and node._v_attrs["format"] == "csr"
+    )
+
+
+def read_csr(node):
+    '''
+    Read a CSR group written by libsvm_to_h5() into memory
+    as a scipy.sparse CSR matrix.
+    '''
+    shape = tuple(int(v) for v in node._v_attrs["shape"])
+    return csr_matrix((node.data.read(), node.indices.read(),
+                       node.indptr.read()), shape=shape)
+
+
+###############################################################################
@@ -0,0 +1,358 @@
+'''Data: manifests recording what each HDF5 file was made from.'''
+
+## External modules.
+import argparse
+import functools
+import hashlib
+import importlib
+import inspect
+import json
+import os
+import sys
+import time
+
+## Internal modules.
+from mml.data import h5write
+
+
+###############################################################################
+
+
+## For reference:
+## Next to each [dataset].h5, the conversion writes [dataset].manifest.json,
+## holding fingerprints of the raw files read, of the converter (hashes
+## of its source and of the mml.data helper modules it uses, the HDF5
+## settings of mml.config, and the options passed to raw_to_h5), and of
+## the output.
+## A fingerprint has the size, the modification time (ns), and a fast
+## hash of the file, which only reads a few sampled blocks; the output
+## also gets a hash of its full content. The manifest is deleted before
+## converting, and only written once conversion succeeds, so a manifest
+## never describes a partially written file.
+
+manifest_version = 1
+_suffix = ".manifest.json"
+_name = "mml.data.manifest" # not __name__, which is "__main__" if run as such.
+
+
+def get_manifest_path(towrite):
+    '''
+    Path of the manifest for the HDF5 file towrite.
+    '''
+    return os.path.splitext(towrite)[0] + _suffix
+
+
+def get_raw_files(converter):
+    '''
+    All raw files read by a data-preparation module, taken to
+    be the module-level variables named "toread*" (either
+    single paths or lists of paths).
+    '''
+    out = []
+    for name in sorted(vars(converter)):
+        value = getattr(converter, name)
+        if not name.startswith("toread"):
+            continue
+        elif isinstance(value, str):
+            out.append(value)
+        elif isinstance(value, (list, tuple)):
+            out.extend(v for v in value if isinstance(v, str))
+    return out
+
+
+def file_hash(toread, chunk_bytes=2**22):
+    '''
+    Hash (BLAKE2b) of the full content of file toread.
+    '''
+    h = hashlib.blake2b(digest_size=16)
+    with open(toread, mode="rb") as f:
+        for chunk in iter(lambda: f.read(chunk_bytes), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def fast_hash(toread, num_samples=16, sample_bytes=2**16):
+    '''
+    Hash (BLAKE2b) of the size of file toread and of
+    num_samples blocks of sample_bytes bytes, spread evenly
+    over the file (including its start and end). This reads
+    at most about 1MB, whatever the file size; small files
+    are hashed in full.
+    '''
+    size = os.path.getsize(toread)
+    h = hashlib.blake2b(str(size).encode(), digest_size=16)
+    with open(toread, mode="rb") as f:
+        if size <= num_samples*sample_bytes:
+            h.update(f.read())
+        else:
+            step = (size-sample_bytes) // (num_samples-1)
+            for i in range(num_samples):
+                f.seek(i*step)
+                h.update(f.read(sample_bytes))
+    return h.hexdigest()
+
+
+def fingerprint(toread, full=False):
+    '''
+    Dict of the size, modification time and fast hash of file
+    toread, plus the hash of its full content if full is True.
+    '''
+    st = os.stat(toread)
+    out = {"size": st.st_size,
+           "mtime_ns": st.st_mtime_ns,
+           "fast_hash": fast_hash(toread=toread)}
+    if full:
+        out["hash"] = file_hash(toread=toread)
+    return out
+
+
+def same_file(toread, fp):
+    '''
+    True if file toread (still) matches the fingerprint fp.
+    Files of the same size are only hashed if their
+    modification time has changed.
+    '''
+    try:
+        st = os.stat(toread)
+    except OSError:
+        return False
+    if st.st_size != fp["size"]:
+        return False
+    elif st.st_mtime_ns == fp["mtime_ns"]:
+        return True
+    else:
+        return fast_hash(toread=toread) == fp["fast_hash"]
+
+
+def get_options(converter, *args, **kwargs):
+    '''
+    All the arguments (defaults included) of a call to the
+    raw_to_h5() function of converter with args and kwargs,
+    as a dict of JSON-compatible values.
+    '''
+    bound = inspect.signature(converter.raw_to_h5).bind(*args, **kwargs)
+    bound.apply_defaults()
+    return json.loads(json.dumps(dict(bound.arguments), default=str))
+
+
+def get_helper_modules(converter):
+    '''
+    All modules of mml.data (bar this one) whose functions,
+    classes or modules a data-preparation module imports,
+    directly or via other such modules, sorted by name.
+    '''
+    found = {}
+    todo = [converter]
+    while todo:
+        module = todo.pop()
+        for value in vars(module).values():
+            if inspect.ismodule(value):
+                helper = value
+            elif inspect.isfunction(value) or inspect.isclass(value):
+                helper = inspect.getmodule(value)
+            else:
+                continue
+            name = getattr(helper, "__name__", "")
+            if (not name.startswith("mml.data.") or name == _name
+                    or name == converter.__name__ or name in found):
+                continue
+            found[name] = helper
+            todo.append(helper)
+    return [found[name] for name in sorted(found)]
+
+
+def get_h5_settings():
+    '''
+    The HDF5 compression and chunking settings (see mml.config)
+    that the data-preparation modules write with.
+    '''
+    return {"h5_complib": h5write.h5_complib,
+            "h5_complevel": h5write.h5_complevel,
+            "h5_shuffle": h5write.h5_shuffle,
+            "h5_chunk_bytes": h5write.h5_chunk_bytes}
+
+
+def get_converter_info(converter, options=None):
+    '''
+    Fingerprint of a data-preparation module: hashes of its
+    source file and of the helper modules it uses (see
+    get_helper_modules()), plus the options raw_to_h5() is
+    run with (if None, the defaults), including the HDF5
+    settings.
+    '''
+    if options is None:
+        options = get_options(converter)
+    options = dict(options, **get_h5_settings())
+    source = inspect.getsourcefile(converter)
+    helpers = {}
+    for helper in get_helper_modules(converter=converter):
+        helpers[helper.__name__] = file_hash(
+            toread=inspect.getsourcefile(helper)
+        )
+    return {"source": os.path.basename(source), # same if run as __main__.
+            "hash": file_hash(toread=source),
+            "helpers": helpers,
+            "options": options}
+
+
+def read_manifest(towrite):
+    '''
+    The manifest (a dict) of the HDF5 file towrite, or None
+    if there is none (or it cannot be read).
+    '''
+    try:
+        with open(get_manifest_path(towrite=towrite), mode="r") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if manifest.get("manifest_version", None) != manifest_version:
+        return None
+    return manifest
+
+
+def write_manifest(converter, options=None):
+    '''
+    Write the manifest of a converter's freshly written output
+    (converter.towrite), fingerprinting its raw files as well.
+    '''
+    towrite = converter.towrite
+    manifest = {
+        "manifest_version": manifest_version,
+        "dataset": converter.data_name,
+        "converter": get_converter_info(converter=converter,
+                                        options=options),
+        "raw": {os.path.basename(f): fingerprint(toread=f)
+                for f in get_raw_files(converter=converter)},
+        "output": fingerprint(toread=towrite, full=True),
+        "time": time.time()
+    }
+    path = get_manifest_path(towrite=towrite)
+    path_tmp = path + ".tmp"
+    with open(path_tmp, mode="w") as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(path_tmp, path)
+    return None
+
+
+def remove_manifest(towrite):
+    '''
+    Delete the manifest of towrite, if any.
+    '''
+    try:
+        os.remove(get_manifest_path(towrite=towrite))
+    except FileNotFoundError:
+        pass
+    return None
+
+
+def check_output(toread, full=False):
+    '''
+    Check the HDF5 file toread against its manifest, returning
+    True if it matches, False if not, and None if there is no
+    manifest. By default only the size and fast hash are
+    compared, which costs a few small reads; if full is True,
+    the whole file is hashed.
+    '''
+    manifest = read_manifest(towrite=toread)
+    if manifest is None:
+        return None
+    fp = manifest["output"]
+    try:
+        if os.path.getsize(toread) != fp["size"]:
+            return False
+    except OSError:
+        return False
+    if full:
+        return file_hash(toread=toread) == fp["hash"]
+    else:
+        return fast_hash(toread=toread) == fp["fast_hash"]
+
+
+def get_output_hash(toread):
+    '''
+    Full-content hash of the HDF5 file toread as recorded in
+    its manifest, if the file (cheaply) checks out against it;
+    None otherwise.
+    '''
+    if check_output(toread=toread):
+        return read_manifest(towrite=toread)["output"]["hash"]
+    else:
+        return None
+
+
+def is_fresh(converter, options=None, check_raw=True):
+    '''
+    True if the output of the converter is up to date, that
+    is, it matches its manifest, the converter (and options)
+    are unchanged, and (if check_raw is True) so are all the
+    raw files. The options are as for get_converter_info().
+    '''
+    manifest = read_manifest(towrite=converter.towrite)
+    if manifest is None or not check_output(toread=converter.towrite):
+        return False
+    if manifest["converter"] != get_converter_info(converter=converter,
+                                                   options=options):
+        return False
+    if check_raw:
+        raw_files = get_raw_files(converter=converter)
+        if sorted(manifest["raw"]) != sorted(
+                os.path.basename(f) for f in raw_files
+        ):
+            return False
+        return all(same_file(toread=f, fp=manifest["raw"][os.path.basename(f)])
+                   for f in raw_files)
+    return True
+
+
+def skip_if_fresh(raw_to_h5):
+    '''
+    Decorator for the raw_to_h5() function of a data-preparation
+    module, which skips conversion when the output is up to date
+    (see is_fresh()), and otherwise writes a new manifest once
+    conversion succeeds. The wrapped function takes an extra
+    keyword argument force; if True, always convert.
+    '''
+    @functools.wraps(raw_to_h5)
+    def wrapper(*args, force=False, **kwargs):
+        converter = sys.modules[raw_to_h5.__module__]
+        options = get_options(converter, *args, **kwargs)
+        if not force and is_fresh(converter=converter, options=options):
+            print("Skipped {} (up to date).".format(converter.data_name))
+            return None
+        remove_manifest(towrite=converter.towrite)
+        out = raw_to_h5(*args, **kwargs)
+        write_manifest(converter=converter, options=options)
+        return out
+
+    return wrapper
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m mml.data.manifest",
+        description=("Exit with status 0 if the HDF5 files of all the "
+                     "given datasets are up to date, else 1.")
+    )
+    parser.add_argument("datasets", nargs="+", metavar="dataset",
+                        help="names of datasets.")
+    parser.add_argument("--check-raw", action="store_true",
+                        help="also require raw files to be unchanged.")
+    args = parser.parse_args(args)
+
+    all_fresh = True
+    for dataset in args.datasets:
+        converter = importlib.import_module(
+            "mml.data.{0}.{0}".format(dataset)
+        )
+        fresh = is_fresh(converter=converter, check_raw=args.check_raw)
+        print("{}: {}".format(dataset,
+                              "up to date" if fresh else "not up to date"))
+        all_fresh = all_fresh and fresh
+    return 0 if all_fresh else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
+
+
+###############################################################################
@@ -8,6 +8,9 @@ import tables
 ## Internal modules.
 from mml.config import dir_data_toread
 from mml.config import dir_data_towrite
+from mml.data.idx import read_idx
+from mml.data.h5write import append_blocks, check_counts, iter_blocks
+from mml.data.manifest import skip_if_fresh
 from mml.utils import makedir_safe
 
 
@@ -32,6 +35,7 @@ towrite = os.path.join(newdir, "mnist.h5")
 n_tr = 60000
 n_te = 10000
 n_all = n_tr+n_te
+img_shape = (28,28)
 num_features = 28*28
 num_classes = 10
 num_labels = 1
@@ -46,90 +50,43 @@ dtype_y = np.uint8
 atom_y = tables.UInt8Atom()
 
 
+@skip_if_fresh
 def raw_to_h5():
     '''
     Transform the raw dataset into one of HDF5 type.
     '''
     
-    X_raw_tr = np.zeros((n_tr,num_features), dtype=dtype_X)
-    y_raw_tr = np.zeros((n_tr,num_labels), dtype=dtype_y)
-    X_raw_te = np.zeros((n_te,num_features), dtype=dtype_X)
-    y_raw_te = np.zeros((n_te,num_labels), dtype=dtype_y)
-    
     print("Preparation: {}".format(data_name))
     
-    ## Populate X_raw_tr.
-    with open(toread_X_tr, mode="rb") as f_bin:
-        
-        print("Read {}.".format(toread_X_tr))
-        f_bin.seek(16) # go to start of images.
-
-        for i in range(n_tr):
-            
-            if i % 5000 == 0:
-                print("(tr) Working... image {}.".format(i))
-
-            for j in range(num_features):
-                X_raw_tr[i,j] = int.from_bytes(f_bin.read(1),
-                                               byteorder="big",
-                                               signed=False)
-    
-    ## Populate X_raw_te.
-    with open(toread_X_te, mode="rb") as f_bin:
-
-        print("Read {}.".format(toread_X_te))
-        f_bin.seek(16) # go to start of images.
-        
-        for i in range(n_te):
-            
-            if i % 1000 == 0:
-                print("(te) Working... image {}.".format(i))
-                
-            for j in range(num_features):
-                X_raw_te[i,j] = int.from_bytes(f_bin.read(1),
-                                               byteorder="big",
-                                               signed=False)
-    
-    ## Populate y_raw_tr.
-    with open(toread_y_tr, mode="rb") as f_bin:
-
-        print("Read {}.".format(toread_y_tr))
-        f_bin.seek(8) # go to start of labels.
-        
-        for i in range(n_tr):
-            y_raw_tr[i,0] = int.from_bytes(f_bin.read(1),
-                                           byteorder="big",
-                                           signed=False)
-
-    ## Populate y_raw_te.
-    with open(toread_y_te, mode="rb") as f_bin:
-
-        print("Read {}.".format(toread_y_te))
-        f_bin.seek(8) # go to start of labels.
-        
-        for i in range(n_te):
-            y_raw_te[i,0] = int.from_bytes(f_bin.read(1),
-                                           byteorder="big",
-                                           signed=False)
-
-
-    ## Concatenate.
-    X_raw = np.vstack((X_raw_tr, X_raw_te))
-    y_raw = np.vstack((y_raw_tr, y_raw_te))
+    ## Memory-map images and labels (headers checked by read_idx).
+    print("Read {}.".format(toread_X_tr))
+    X_raw_tr = read_idx(toread=toread_X_tr, mmap=True)
+    print("Read {}.".format(toread_X_te))
+    X_raw_te = read_idx(toread=toread_X_te, mmap=True)
+    print("Read {}.".format(toread_y_tr))
+    y_raw_tr = read_idx(toread=toread_y_tr, mmap=True)
+    print("Read {}.".format(toread_y_te))
+    y_raw_te = read_idx(toread=toread_y_te, mmap=True)
     
-    ## Create and populate the HDF5 file.
+    ## Copy over to the HDF5 file, one block at a time.
     makedir_safe(newdir)
     with tables.open_file(towrite, mode="w", title=title) as myh5:
-        myh5.create_array(where=myh5.root,
-                          name="X",
-                          obj=X_raw,
-                          atom=atom_X,
-                          title=title_X)
-        myh5.create_array(where=myh5.root,
-                          name="y",
-                          obj=y_raw,
-                          atom=atom_y,
-                          title=title_y)
+        counts = append_blocks(myh5=myh5,
+                               sources=[iter_blocks(X=X_raw_tr, y=y_raw_tr),
+                                        iter_blocks(X=X_raw_te, y=y_raw_te)],
+                               atom_X=atom_X,
+                               atom_y=atom_y,
+                               title_X=title_X,
+                               title_y=title_y,
+                               expectedrows=n_all)
+        
+        ## Check that the number of instances is as expected.
+        check_counts(counts=counts, expected=[n_tr, n_te],
+                     names=["tr", "te"])
+        if myh5.root.X.shape[1] != num_features:
+            raise ValueError("Images have {} pixels; expected {}.".format(
+                myh5.root.X.shape[1], num_features
+            ))
         print(myh5)
 
     print("Wrote {}.".format(towrite))
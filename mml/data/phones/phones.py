@@ -1,7 +1,6 @@
 '''H5 data prep'''
 
 ## External modules.
-import csv
 import numpy as np
 import os
 import tables
@@ -9,6 +8,9 @@ import tables
 ## Internal modules.
 from mml.config import dir_data_toread
 from mml.config import dir_data_towrite
+from mml.data.h5write import append_blocks, check_counts
+from mml.data.manifest import skip_if_fresh
+from mml.data.tabular import iter_tabular
 from mml.utils import makedir_safe
 
 
@@ -43,69 +45,39 @@ atom_X = tables.Float32Atom()
 dtype_y = np.float32
 atom_y = tables.Float32Atom()
 
-def parse_line(x, y):
-
-    ## Both inputs and outputs are super easy to parse.
-    x_out = np.array(x, dtype=dtype_X)
-    y_out = np.array(y, dtype=dtype_y)
-    return x_out, y_out
+## Schema of the raw table.
+schema = {"attribute_names": attribute_names,
+          "attribute_dict": attribute_dict,
+          "delimiter": ",",
+          "skip_rows": 1, # skip the first row.
+          "skipinitialspace": True,
+          "dtype_X": dtype_X,
+          "dtype_y": dtype_y}
 
 
+@skip_if_fresh
 def raw_to_h5():
     '''
     Transform the raw dataset into one of HDF5 type.
     '''
     
-    X_raw = np.zeros((n_all,num_features), dtype=dtype_X)
-    y_raw = np.zeros((n_all,num_labels), dtype=dtype_y)
-    
     print("Preparation: {}".format(data_name))
     
-    ## Read in the raw data.
-    with open(toread, newline="") as f_table:
-
+    ## Stream the raw data into the HDF5 file, one block at a time.
+    makedir_safe(newdir)
+    with tables.open_file(towrite, mode="w", title=title) as myh5:
         print("Read {}.".format(toread))
-        
-        f_reader = csv.reader(f_table, delimiter=",",
-                              skipinitialspace=True)
-        
-        ## Populate the placeholder numpy arrays.
-        idx = 0
-        for linenum, line in enumerate(f_reader):
-
-            if linenum == 0:
-                continue # skip the first row.
-            
-            if len(line) == 0:
-                continue # do nothing for blank lines.
-            
-            ## Numpy arrays for individual instance.
-            x, y = parse_line(x=line[0:-1], y=line[-1])
-            X_raw[idx,:] = x
-            y_raw[idx,0] = y
-            
-            ## Update the index.
-            idx += 1
+        counts = append_blocks(myh5=myh5,
+                               sources=[iter_tabular(toread=toread,
+                                                     **schema)],
+                               atom_X=atom_X,
+                               atom_y=atom_y,
+                               title_X=title_X,
+                               title_y=title_y,
+                               expectedrows=n_all)
         
         ## Check that number of *clean* instances is as expected.
-        print(
-            "Number of clean guys: {}. Note n_all = {}".format(idx,n_all)
-        )
-
-
-    ## Create and populate the HDF5 file.
-    makedir_safe(newdir)
-    with tables.open_file(towrite, mode="w", title=title) as myh5:
-        myh5.create_array(where=myh5.root,
-                          name="X",
-                          obj=X_raw,
-                          atom=atom_X,
-                          title=title_X)
-        myh5.create_array(where=myh5.root,
-                          name="y",
-                          obj=y_raw,
-                          atom=atom_y,
-                          title=title_y)
+        check_counts(counts=counts, expected=[n_all], names=["all"])
         print(myh5)
 
     print("Wrote {}.".format(towrite))
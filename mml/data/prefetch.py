@@ -0,0 +1,141 @@
+'''Data: background prefetching for minibatch iterators.'''
+
+## External modules.
+import numpy as np
+import queue
+import threading
+
+
+###############################################################################
+
+
+## Markers passed from the worker thread to the consumer.
+_done = "done"
+_error = "error"
+_batch = "batch"
+
+
+class Prefetcher:
+    '''
+    Wraps any iterable of batches (e.g., a BatchStream), and
+    prepares the next num_prefetch batches on a background
+    thread while the consumer is busy with the current one.
+    This pays off since reading from disk (PyTables) and the
+    bulk array operations done by NumPy release the GIL.
+
+    A batch can be a single ndarray or a tuple of ndarrays
+    (None entries are passed through). Batches are handed to
+    the consumer as the source yields them, with no copying,
+    which is right for sources that yield new arrays for each
+    batch (such as BatchStream). Sources that refill the same
+    arrays for each batch (such as Minibatch.batches()) need
+    copy=True, so that each batch is copied once prefetched.
+
+    Exceptions raised in the source iterator are re-raised in
+    the consumer thread. Use close() (or a with block) to stop
+    the worker early; it is also stopped after exhaustion.
+    '''
+
+    def __init__(self, batches, num_prefetch=2, copy=False):
+        if num_prefetch < 1:
+            raise ValueError("num_prefetch must be at least 1.")
+        self.batches = batches
+        self.num_prefetch = num_prefetch
+        self.copy = copy
+        self._thread = None
+        self._stop = threading.Event()
+        self._filled = None
+        return None
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+
+    def __iter__(self):
+        self.close()
+        self._stop.clear()
+
+        ## Filled batches wait here; bounded by num_prefetch.
+        self._filled = queue.Queue(maxsize=self.num_prefetch)
+
+        self._thread = threading.Thread(target=self._work,
+                                        args=(iter(self.batches),),
+                                        daemon=True)
+        self._thread.start()
+        return self
+
+
+    def __next__(self):
+        if self._thread is None:
+            raise StopIteration
+
+        marker, content = self._filled.get()
+        if marker == _batch:
+            return content
+        else:
+            self._thread.join()
+            self._thread = None
+            if marker == _error:
+                raise content
+            else:
+                raise StopIteration
+
+
+    def _put(self, q, item):
+        '''
+        Blocking put which gives up once stop is requested.
+        '''
+        while not self._stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+
+    def _copy(self, batch):
+        '''
+        Copy of each (non-None) array in batch.
+        '''
+        if isinstance(batch, tuple):
+            return tuple(None if part is None else np.copy(part)
+                         for part in batch)
+        else:
+            return np.copy(batch)
+
+
+    def _work(self, batches):
+        '''
+        Worker thread: pull batches from the source and queue them.
+        '''
+        try:
+            for batch in batches:
+                if self.copy:
+                    batch = self._copy(batch=batch)
+                if not self._put(self._filled, (_batch, batch)):
+                    return None
+            self._put(self._filled, (_done, None))
+        except BaseException as e:
+            self._put(self._filled, (_error, e))
+        return None
+
+
+    def close(self):
+        '''
+        Stop the worker thread (if running) and wait for it.
+        '''
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+        return None
+
+
+###############################################################################
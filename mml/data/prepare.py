@@ -0,0 +1,137 @@
+'''Data: convert raw data for many datasets to HDF5, in parallel.'''
+
+## External modules.
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import importlib
+import os
+import sys
+import time
+
+## Internal modules.
+from mml.data import dataset_dict, dataset_list, write_sidecars
+from mml.data.manifest import get_raw_files, is_fresh
+
+
+###############################################################################
+
+
+## For reference:
+## Usage is typically (from mml/data, after running getdata.sh):
+##   python -m mml.data.prepare [-j WORKERS] [--force] [--sidecars] dataset1 ...
+## Each dataset's raw_to_h5() is run in its own worker process. Raw files
+## must already be on local disk; nothing is downloaded here. Datasets
+## whose output matches its manifest (see mml.data.manifest), with the
+## same converter and raw files, are skipped. With --sidecars, .npy copies
+## of X and y are written as well (see mml.data.write_sidecars), for
+## get_data to memory-map instead of reading the HDF5 file.
+
+
+def get_converter(dataset):
+    '''
+    The data-preparation module of the given dataset,
+    e.g., mml.data.mnist.mnist for "mnist".
+    '''
+    return importlib.import_module("mml.data.{0}.{0}".format(dataset))
+
+
+def prepare_one(dataset, force=False, sidecars=False):
+    '''
+    Run the raw_to_h5() conversion for a single dataset,
+    unless its output is already up to date (and force is
+    False). An intact output made by the same converter is
+    also kept if its raw files have since been deleted.
+    If sidecars is True, .npy sidecars are then written too,
+    unless they are up to date already.
+    Returns a pair (status, wall time in seconds).
+    '''
+    converter = get_converter(dataset=dataset)
+    time_start = time.perf_counter()
+
+    missing = [f for f in get_raw_files(converter=converter)
+               if not os.path.exists(f)]
+
+    if not force and is_fresh(converter=converter):
+        status = "skipped (up to date)"
+    elif not force and len(missing) > 0 and is_fresh(converter=converter,
+                                                     check_raw=False):
+        status = "skipped (up to date, raw files gone)"
+    elif len(missing) > 0:
+        raise FileNotFoundError(
+            "Raw files missing: {}".format(", ".join(missing))
+        )
+    else:
+        converter.raw_to_h5(force=True)
+        status = "done"
+
+    if sidecars:
+        write_sidecars(dataset=dataset, paras=dataset_dict[dataset],
+                       directory=os.path.dirname(converter.newdir))
+    return (status, time.perf_counter()-time_start)
+
+
+def prepare(datasets, workers=None, force=False, sidecars=False):
+    '''
+    Prepare all the given datasets concurrently, using a pool
+    of (at most) workers processes, and print a summary of
+    per-dataset wall times. Returns a dict mapping each
+    dataset to its (status, wall time) pair.
+    '''
+    results = {}
+    time_start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(prepare_one, dataset, force,
+                                   sidecars): dataset
+                   for dataset in datasets}
+        for future in as_completed(futures):
+            dataset = futures[future]
+            try:
+                results[dataset] = future.result()
+            except Exception as e:
+                results[dataset] = ("failed: {}".format(e), None)
+            print("Finished: {} ({}).".format(dataset, results[dataset][0]))
+    time_total = time.perf_counter()-time_start
+
+    print("--Summary--")
+    for dataset in datasets:
+        status, seconds = results[dataset]
+        if seconds is None:
+            print("{}: {}".format(dataset, status))
+        else:
+            print("{}: {} [{:.2f}s]".format(dataset, status, seconds))
+    print("Total wall time: {:.2f}s".format(time_total))
+    return results
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m mml.data.prepare",
+        description="Convert raw datasets to HDF5 in parallel."
+    )
+    parser.add_argument("datasets", nargs="*", metavar="dataset",
+                        help="names of datasets (default: all).")
+    parser.add_argument("-j", "--workers", type=int, default=None,
+                        help="number of worker processes.")
+    parser.add_argument("--force", action="store_true",
+                        help="convert even if output is up to date.")
+    parser.add_argument("--sidecars", action="store_true",
+                        help="also write .npy sidecars of X and y.")
+    args = parser.parse_args(args)
+
+    datasets = args.datasets if len(args.datasets) > 0 else dataset_list
+    unknown = [d for d in datasets if d not in dataset_list]
+    if len(unknown) > 0:
+        parser.error("unknown datasets: {}".format(", ".join(unknown)))
+
+    results = prepare(datasets=datasets, workers=args.workers,
+                      force=args.force, sidecars=args.sidecars)
+    failed = [d for d, (status, _) in results.items()
+              if status.startswith("failed")]
+    return 1 if len(failed) > 0 else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
+
+
+###############################################################################
@@ -1,7 +1,6 @@
 '''H5 data prep'''
 
 ## External modules.
-import csv
 import numpy as np
 import os
 import tables
@@ -9,6 +8,9 @@ import tables
 ## Internal modules.
 from mml.config import dir_data_toread
 from mml.config import dir_data_towrite
+from mml.data.h5write import append_blocks, check_counts
+from mml.data.manifest import skip_if_fresh
+from mml.data.tabular import iter_tabular
 from mml.utils import makedir_safe
 
 
@@ -37,50 +39,40 @@ atom_X = tables.Float32Atom()
 dtype_y = np.uint8
 atom_y = tables.UInt8Atom()
 
+## Schema of the raw table (all numeric).
+schema = {"feature_cols": slice(3,None),
+          "label_col": 2,
+          "delimiter": "\t",
+          "dtype_X": dtype_X,
+          "dtype_y": dtype_y}
 
+
+@skip_if_fresh
 def raw_to_h5():
     '''
     Transform the raw dataset into one of HDF5 type.
     '''
     
-    X_raw = np.zeros((n_all,num_features), dtype=dtype_X)
-    y_raw = np.zeros((n_all,num_labels), dtype=dtype_y)
-    
     print("Preparation: {}".format(data_name))
-
-    ## Read in the raw data.
-    with open(toread, newline="") as f_table:
-
+    
+    ## Stream the raw data into the HDF5 file, one block at a time.
+    makedir_safe(newdir)
+    with tables.open_file(towrite, mode="w", title=title) as myh5:
         print("Read {}.".format(toread))
+        counts = append_blocks(myh5=myh5,
+                               sources=[iter_tabular(toread=toread,
+                                                     **schema)],
+                               atom_X=atom_X,
+                               atom_y=atom_y,
+                               title_X=title_X,
+                               title_y=title_y,
+                               expectedrows=n_all)
         
-        f_reader = csv.reader(f_table, delimiter="\t")
-        
-        ## Populate the placeholder numpy arrays.
-        i = 0
-        for line in f_reader:
-            if len(line) > 0:
-                X_raw[i,:] = np.array(line[3:],
-                                      dtype=X_raw.dtype)
-                y_raw[i,0] = np.array(line[2],
-                                      dtype=y_raw.dtype)
-            i += 1
-        
-        ## Create and populate the HDF5 file.
-        makedir_safe(newdir)
-        with tables.open_file(towrite, mode="w", title=title) as myh5:
-            myh5.create_array(where=myh5.root,
-                              name="X",
-                              obj=X_raw,
-                              atom=atom_X,
-                              title=title_X)
-            myh5.create_array(where=myh5.root,
-                              name="y",
-                              obj=y_raw,
-                              atom=atom_y,
-                              title=title_y)
-            print(myh5)
-
-        print("Wrote {}.".format(towrite))
+        ## Check that number of *clean* instances is as expected.
+        check_counts(counts=counts, expected=[n_all], names=["all"])
+        print(myh5)
+
+    print("Wrote {}.".format(towrite))
 
     ## Exit all context managers before returning.
     print("Done ({}).".format(data_name))
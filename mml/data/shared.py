@@ -0,0 +1,277 @@
+'''Data: sharing prepared data splits between processes.'''
+
+## External modules.
+import json
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+import numpy as np
+import os
+from scipy.sparse import csr_matrix, issparse
+import secrets
+import threading
+import weakref
+
+## Internal modules.
+from mml.data.lazy import LazyArray
+
+
+###############################################################################
+
+
+## For reference:
+## Typical use, for many experiments with the same data on one node:
+##   (loader)  shared = publish(splits=get_data_general(...))
+##             ... start the workers, passing them shared.name ...
+##   (worker)  X_train, y_train, X_val, y_val, X_test, y_test, paras = (
+##                 attach(name)
+##             )
+## The data is held once, in named shared memory segments; workers get
+## read-only ndarray views of it, with no copying. Each split is stored
+## as one segment per array (ndarray; data/indices/indptr for CSR; the
+## stored array plus shift/scale for in-memory LazyArray), and a further
+## segment [name]_meta holds the layout (as JSON), plus the paras.
+## Segments are removed when the owner (the SharedSplits object) is
+## closed or garbage-collected, or at the latest when its process exits;
+## workers that are already attached keep working until they are done.
+
+_meta_suffix = "_meta"
+_attached = {} # keeps segments open while views into them are in use.
+_register_lock = threading.Lock() # see _attach_segment().
+
+
+def _json_default(obj):
+    '''
+    JSON fallback for NumPy scalars and anything else.
+    '''
+    return obj.item() if isinstance(obj, np.generic) else str(obj)
+
+
+def _unlink(segments, pid):
+    '''
+    Close and remove segments (only in the owner process;
+    forked children hold copies of the owner object too).
+    '''
+    if os.getpid() != pid:
+        return None
+    for shm in segments:
+        try:
+            shm.unlink()
+        except FileNotFoundError:
+            pass
+        try:
+            shm.close()
+        except BufferError:
+            pass # views still in use; memory is freed at exit.
+    return None
+
+
+def _attach_segment(name):
+    '''
+    Attach to an existing segment without registering it with
+    this process's resource tracker, so that this process never
+    removes it on exit (that is up to the owner).
+    '''
+    try:
+        return SharedMemory(name=name, track=False) # Python 3.13+.
+    except TypeError:
+        pass
+    ## Before 3.13, attaching always registers the segment, and a tracker
+    ## that is not the owner's would remove it when this process exits;
+    ## so skip registering for this call only (nothing to undo later).
+    with _register_lock:
+        register = resource_tracker.register
+        resource_tracker.register = lambda name, rtype: None
+        try:
+            return SharedMemory(name=name)
+        finally:
+            resource_tracker.register = register
+
+
+def _view(shm, shape, dtype):
+    '''
+    Read-only ndarray view of a segment.
+    '''
+    out = np.ndarray(shape=shape, dtype=dtype, buffer=shm.buf)
+    out.flags.writeable = False
+    return out
+
+
+class SharedSplits:
+    '''
+    Owner of the shared memory segments holding published
+    data splits (see publish()). Segments are removed by
+    close(), on leaving a with block, when this object is
+    garbage-collected, or when the process exits, whichever
+    comes first; keep a reference for as long as workers
+    may still need to attach.
+
+    The splits attribute holds this process's own (zero-copy,
+    read-only) views, in the same format as attach() returns,
+    so the original arrays need not be kept around.
+    '''
+
+    def __init__(self, name, segments, splits):
+        self.name = name
+        self.splits = splits
+        self._finalizer = weakref.finalize(self, _unlink,
+                                           segments, os.getpid())
+        return None
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *args):
+        self.close()
+        return None
+
+
+    def close(self):
+        '''
+        Remove the segments; later calls to attach() will fail.
+        '''
+        self.splits = None
+        self._finalizer()
+        return None
+
+
+def _to_parts(A):
+    '''
+    Split an array-like A into its kind and a dict of
+    ndarrays (None entries allowed), plus extra layout info.
+    '''
+    if issparse(A):
+        A = A.tocsr()
+        return ("csr", {"data": A.data, "indices": A.indices,
+                        "indptr": A.indptr}, {"shape": A.shape})
+    elif isinstance(A, LazyArray):
+        parts = A.in_memory_parts()
+        if parts is None:
+            raise TypeError("Only in-memory LazyArray data can be shared.")
+        return ("lazy", {"source": np.asarray(parts["source"]),
+                         "shift": parts["shift"], "scale": parts["scale"]},
+                {"dtype": parts["dtype"].str})
+    else:
+        return ("dense", {"array": np.asarray(A)}, {})
+
+
+def _from_parts(kind, parts, info):
+    '''
+    Inverse of _to_parts(), given views of the parts.
+    '''
+    if kind == "csr":
+        return csr_matrix((parts["data"], parts["indices"], parts["indptr"]),
+                          shape=tuple(info["shape"]), copy=False)
+    elif kind == "lazy":
+        return LazyArray(source=parts["source"], dtype=info["dtype"],
+                         shift=parts["shift"], scale=parts["scale"])
+    else:
+        return parts["array"]
+
+
+def publish(splits, paras=None, name=None):
+    '''
+    Copy data splits into shared memory, once, for any number
+    of processes on this machine to attach() to by name.
+    - splits: a tuple of arrays (None entries allowed), such as
+      (X_train, y_train, X_val, y_val, X_test, y_test); if the
+      last entry is a dict, it is taken to be paras, so the
+      output of get_data_general() can be passed as is. Arrays
+      can be ndarrays, scipy.sparse matrices, or in-memory
+      LazyArray handles (as used with keep_uint8=True).
+    - paras: dataset paras to share (JSON-compatible values).
+    - name: prefix of the segment names; random if None.
+    Returns a SharedSplits object, the owner of the segments.
+    '''
+    splits = tuple(splits)
+    if len(splits) > 0 and isinstance(splits[-1], dict):
+        splits, paras = (splits[:-1], splits[-1])
+    if name is None:
+        name = "mml_{}".format(secrets.token_hex(6))
+
+    segments = []
+    meta = {"splits": [], "paras": paras}
+    views = []
+    try:
+        for i, A in enumerate(splits):
+            if A is None:
+                meta["splits"].append(None)
+                views.append(None)
+                continue
+            kind, parts, info = _to_parts(A)
+            layout = {}
+            part_views = {}
+            for part, array in parts.items():
+                if array is None:
+                    layout[part] = None
+                    part_views[part] = None
+                    continue
+                shm = SharedMemory(name="{}_{}_{}".format(name, i, part),
+                                   create=True, size=max(array.nbytes, 1))
+                segments.append(shm)
+                view = np.ndarray(shape=array.shape, dtype=array.dtype,
+                                  buffer=shm.buf)
+                view[...] = array
+                view.flags.writeable = False
+                layout[part] = {"segment": shm.name,
+                                "shape": array.shape,
+                                "dtype": array.dtype.str}
+                part_views[part] = view
+            meta["splits"].append({"kind": kind, "parts": layout,
+                                   "info": info})
+            views.append(_from_parts(kind=kind, parts=part_views, info=info))
+
+        meta_bytes = json.dumps(meta, default=_json_default).encode()
+        shm = SharedMemory(name=name+_meta_suffix, create=True,
+                           size=len(meta_bytes)+8)
+        segments.append(shm)
+        shm.buf[0:8] = len(meta_bytes).to_bytes(8, "little")
+        shm.buf[8:(8+len(meta_bytes))] = meta_bytes
+    except BaseException:
+        _unlink(segments=segments, pid=os.getpid())
+        raise
+
+    print("Published {} splits as {}.".format(len(splits), name))
+    return SharedSplits(name=name, segments=segments,
+                        splits=tuple(views)+(paras,))
+
+
+def attach(name):
+    '''
+    Attach to splits published (by any process on this machine)
+    under name, returning the tuple of read-only views of the
+    splits in the order published, followed by the paras (a
+    dict, or None). Nothing is copied. Segments are kept open
+    until the process exits.
+    '''
+    if name in _attached:
+        return _attached[name][1]
+
+    segments = [_attach_segment(name=name+_meta_suffix)]
+    size = int.from_bytes(bytes(segments[0].buf[0:8]), "little")
+    meta = json.loads(bytes(segments[0].buf[8:(8+size)]).decode())
+
+    views = []
+    for split in meta["splits"]:
+        if split is None:
+            views.append(None)
+            continue
+        part_views = {}
+        for part, layout in split["parts"].items():
+            if layout is None:
+                part_views[part] = None
+                continue
+            shm = _attach_segment(name=layout["segment"])
+            segments.append(shm)
+            part_views[part] = _view(shm=shm, shape=tuple(layout["shape"]),
+                                     dtype=np.dtype(layout["dtype"]))
+        views.append(_from_parts(kind=split["kind"], parts=part_views,
+                                 info=split["info"]))
+
+    out = tuple(views) + (meta["paras"],)
+    _attached[name] = (segments, out)
+    return out
+
+
+###############################################################################
@@ -0,0 +1,218 @@
+'''Data: split definitions as index arrays, and k-fold generators.'''
+
+## External modules.
+import numpy as np
+import os
+import tables
+
+## Internal modules.
+from mml.data.h5write import create_carray
+
+
+###############################################################################
+
+
+## For reference:
+## A split is a dict mapping subset names (e.g., "train", "val", "test")
+## to 1-dim arrays of row indices, all views into a single permutation of
+## range(n), so a split costs one index per row (stored as uint32 when
+## n allows). Folds for k-fold cross-validation are given by a dict with
+## a permutation "perm", and the fold boundaries "bounds" within it; the
+## k-th test set is perm[bounds[k]:bounds[k+1]], and the rest is the
+## training set. Rows of X are only ever gathered by the caller, using
+## these indices, so there is never a copy of X per fold.
+## Splits are stored in [dataset]_splits.h5, next to [dataset].h5, with
+## one group per named split; the dataset file itself is never modified.
+
+
+def index_dtype(n):
+    '''
+    Smallest (unsigned) dtype that can index n rows.
+    '''
+    return np.dtype(np.uint32) if n < 2**32 else np.dtype(np.int64)
+
+
+def get_split_indices(n, paras, rg, do_shuffle=True):
+    '''
+    Train/validation/test split of n rows, with sizes set by
+    the "n_train_frac" and "n_val_frac" entries of paras,
+    exactly as done in get_data_general (which uses this),
+    given the same random generator rg.
+    '''
+    if do_shuffle:
+        perm = rg.permutation(n).astype(index_dtype(n))
+    else:
+        perm = np.arange(n, dtype=index_dtype(n))
+    return _split_perm(perm=perm, paras=paras)
+
+
+def get_stratified_split_indices(y, paras, rg):
+    '''
+    Same as get_split_indices(), but such that the class
+    proportions of the (n,1) class index labels y are (up to
+    rounding) the same in all subsets. Rows of each class are
+    shuffled, and then spread evenly over one ordering of all
+    rows, which is cut into subsets as usual.
+    '''
+    perm = _stratified_perm(labels=y.reshape(-1), rg=rg)
+    return _split_perm(perm=perm, paras=paras)
+
+
+def _split_perm(perm, paras):
+    '''
+    Cut a permutation into train/val/test index views.
+    '''
+    n = len(perm)
+    n_train = int(n*paras["n_train_frac"])
+    n_val = int(n*paras["n_val_frac"])
+    return {"train": perm[0:n_train],
+            "val": perm[n_train:(n_train+n_val)],
+            "test": perm[(n_train+n_val):]}
+
+
+def _stratified_perm(labels, rg):
+    '''
+    Permutation of range(len(labels)) in which each class
+    is spread out evenly: the i-th of the (shuffled) n_c
+    members of a class sits at relative position (i+u)/n_c,
+    with u uniform on [0,1), and rows are sorted by this.
+    Any contiguous run of rows is then nearly stratified.
+    '''
+    n = len(labels)
+    _, inverse, counts = np.unique(labels, return_inverse=True,
+                                   return_counts=True)
+    inverse = inverse.reshape(-1)
+    ranks = np.empty(n, dtype=np.float64)
+    for c, count in enumerate(counts):
+        members = np.flatnonzero(inverse == c)
+        ranks[rg.permutation(members)] = (
+            np.arange(count) + rg.random()
+        ) / count
+    return np.argsort(ranks, kind="stable").astype(index_dtype(n))
+
+
+def get_folds(n, num_folds, rg=None):
+    '''
+    Folds (see above) for k-fold cross-validation over n
+    rows, with num_folds folds of (nearly) equal size; rows
+    are shuffled by rg first, unless rg is None.
+    '''
+    if num_folds < 2 or num_folds > n:
+        raise ValueError("Need 2 <= num_folds <= n.")
+    if rg is None:
+        perm = np.arange(n, dtype=index_dtype(n))
+    else:
+        perm = rg.permutation(n).astype(index_dtype(n))
+    bounds = np.linspace(0, n, num_folds+1).astype(np.int64)
+    return {"perm": perm, "bounds": bounds}
+
+
+def get_stratified_folds(y, num_folds, rg):
+    '''
+    Same as get_folds(), but with the class proportions of
+    the (n,1) class index labels y kept (up to rounding)
+    the same in each fold.
+    '''
+    folds = get_folds(n=len(y), num_folds=num_folds, rg=None)
+    folds["perm"] = _stratified_perm(labels=y.reshape(-1), rg=rg)
+    return folds
+
+
+def iter_folds(folds):
+    '''
+    Generator over the pairs (idx_train, idx_test) of index
+    arrays for each fold in folds. All of these are views
+    into one array holding the permutation twice, so nothing
+    is allocated per fold.
+    '''
+    perm = folds["perm"]
+    n = len(perm)
+    perm_twice = np.concatenate((perm, perm))
+    bounds = folds["bounds"]
+    for start, stop in zip(bounds[:-1], bounds[1:]):
+        yield (perm_twice[stop:(start+n)], perm_twice[start:stop])
+
+
+def kfold(n, num_folds, rg=None):
+    '''
+    Generator over (idx_train, idx_test) for k-fold
+    cross-validation; see get_folds() and iter_folds().
+    '''
+    return iter_folds(folds=get_folds(n=n, num_folds=num_folds, rg=rg))
+
+
+def stratified_kfold(y, num_folds, rg):
+    '''
+    Generator over (idx_train, idx_test) for stratified
+    k-fold cross-validation; see get_stratified_folds().
+    '''
+    return iter_folds(folds=get_stratified_folds(y=y, num_folds=num_folds,
+                                                 rg=rg))
+
+
+def get_split_path(toread):
+    '''
+    Path of the file holding the stored splits of the
+    HDF5 file toread, e.g., mnist/mnist.h5 -> mnist/mnist_splits.h5.
+    '''
+    return "{}_splits.h5".format(os.path.splitext(toread)[0])
+
+
+def save_split(toread, name, split, n=None):
+    '''
+    Store split (a dict of index arrays, either a split or
+    folds) for the data in toread, under the given name,
+    replacing any split of the same name.
+    - n: number of rows of the data, checked when loading.
+    '''
+    with tables.open_file(get_split_path(toread=toread), mode="a") as f:
+        if name in f.root:
+            f.remove_node(where=f.root, name=name, recursive=True)
+        group = f.create_group(where=f.root, name=name)
+        if n is not None:
+            group._v_attrs["n"] = n
+        for key, idx in split.items():
+            create_carray(myh5=f, name=key, obj=idx,
+                          atom=tables.Atom.from_dtype(idx.dtype),
+                          where=group, stats=False)
+    return None
+
+
+def load_split(toread, name, n=None):
+    '''
+    The split stored under name for the data in toread,
+    or None if there is no such split. If n is given, it
+    is checked against the number of rows stored with the
+    split (if any), raising a ValueError on mismatch.
+    '''
+    path = get_split_path(toread=toread)
+    if not os.path.exists(path):
+        return None
+    with tables.open_file(path, mode="r") as f:
+        if name not in f.root:
+            return None
+        group = f.get_node(where=f.root, name=name)
+        if n is not None and "n" in group._v_attrs and (
+                int(group._v_attrs["n"]) != n
+        ):
+            raise ValueError(
+                "Split {} is for {} rows; data has {}.".format(
+                    name, int(group._v_attrs["n"]), n
+                )
+            )
+        split = {node.name: node.read() for node in group}
+    if "perm" in split or "train" not in split:
+        return split
+
+    ## Re-assemble a train/val/test split as views of one permutation.
+    keys = [k for k in ("train", "val", "test") if k in split]
+    perm = np.concatenate([split[k] for k in keys])
+    out = {}
+    start = 0
+    for k in keys:
+        out[k] = perm[start:(start+len(split[k]))]
+        start += len(split[k])
+    return out
+
+
+###############################################################################
@@ -0,0 +1,197 @@
+'''Data: per-feature statistics, computed once and stored in HDF5.'''
+
+## External modules.
+import numpy as np
+from scipy.sparse import issparse
+import tables
+
+
+###############################################################################
+
+
+## For reference:
+## Statistics are stored as attributes of the node they describe (for
+## CSR groups, attributes of the group), under the names below. All are
+## per-column arrays, with shape (num_features,) for a 2-dim node.
+
+_stats_names = ["count", "min", "max", "mean", "var"]
+_prefix = "stats_"
+_class_counts = "class_counts"
+
+
+class RunningStats:
+    '''
+    Per-column count, min, max, mean and (population) variance,
+    accumulated over blocks of rows in a single pass. Moments of
+    each block are merged into the running ones (Chan et al.'s
+    pairwise form of Welford's update), so the result does not
+    depend on how rows are split into blocks, up to round-off.
+    Blocks can be ndarrays or scipy.sparse matrices; large dense
+    blocks are split up, so float64 temporaries take at most about
+    block_bytes bytes.
+
+    If count_values is True (for integer labels), the number of
+    times each value 0,1,2,... occurs is counted per column.
+    '''
+
+    def __init__(self, count_values=False, block_bytes=2**24):
+        self.count = 0
+        self.min = None
+        self.max = None
+        self.mean = None
+        self.m2 = None # sum of squared deviations from the mean.
+        self.count_values = count_values
+        self.value_counts = None
+        self.block_bytes = block_bytes # bounds float64 temporaries.
+        return None
+
+
+    def update(self, X):
+        '''
+        Merge in the statistics of one block of rows X.
+        '''
+        n = X.shape[0]
+        if n == 0:
+            return None
+
+        if not issparse(X):
+            X = np.asarray(X).reshape((n,-1))
+            block_rows = max(1, self.block_bytes // (8*max(X.shape[1],1)))
+            if n > block_rows:
+                for start in range(0, n, block_rows):
+                    self.update(X[start:(start+block_rows)])
+                return None
+
+        if issparse(X):
+            X = X.tocsc()
+            mean = np.asarray(X.sum(axis=0), dtype=np.float64).reshape(-1)/n
+            sq = np.asarray(X.multiply(X).sum(axis=0),
+                            dtype=np.float64).reshape(-1)
+            m2 = np.clip(sq - n*mean**2, a_min=0.0, a_max=None)
+            bmin = X.min(axis=0).toarray().reshape(-1).astype(np.float64)
+            bmax = X.max(axis=0).toarray().reshape(-1).astype(np.float64)
+            # note: sparse min/max do account for the implicit zeros.
+        else:
+            bmin = X.min(axis=0).astype(np.float64)
+            bmax = X.max(axis=0).astype(np.float64)
+            mean = X.mean(axis=0, dtype=np.float64)
+            m2 = ((X-mean)**2).sum(axis=0)
+            if self.count_values:
+                self._update_counts(X=X)
+
+        if self.count > 0 and len(mean) > len(self.mean):
+            ## Sparse data, with columns not seen until now; the rows
+            ## so far were all zero in these columns.
+            width = (0, len(mean)-len(self.mean))
+            self.min, self.max, self.mean, self.m2 = (
+                np.pad(v, width) for v in (self.min, self.max,
+                                           self.mean, self.m2)
+            )
+
+        if self.count == 0:
+            self.min, self.max, self.mean, self.m2 = (bmin, bmax, mean, m2)
+        else:
+            count_new = self.count + n
+            delta = mean - self.mean
+            self.mean += delta * (n/count_new)
+            self.m2 += m2 + delta**2 * (self.count*n/count_new)
+            np.minimum(self.min, bmin, out=self.min)
+            np.maximum(self.max, bmax, out=self.max)
+        self.count += n
+        return None
+
+
+    def _update_counts(self, X):
+        '''
+        Per-column counts of the (non-negative integer) values.
+        '''
+        if not np.issubdtype(X.dtype, np.integer) or X.min() < 0:
+            self.count_values = False # not labels, so skip.
+            self.value_counts = None
+            return None
+        num_values = int(X.max())+1
+        counts = np.stack([np.bincount(X[:,j], minlength=num_values)
+                           for j in range(X.shape[1])])
+        if self.value_counts is None:
+            self.value_counts = counts
+        else:
+            width = max(counts.shape[1], self.value_counts.shape[1])
+            self.value_counts = np.pad(
+                self.value_counts,
+                ((0,0), (0,width-self.value_counts.shape[1]))
+            ) + np.pad(counts, ((0,0), (0,width-counts.shape[1])))
+        return None
+
+
+    @property
+    def var(self):
+        return None if self.m2 is None else self.m2 / max(self.count, 1)
+
+
+    def to_node(self, node):
+        '''
+        Store the statistics as attributes of node.
+        '''
+        if self.count == 0:
+            return None
+        values = {"count": np.full(len(self.mean), self.count),
+                  "min": self.min, "max": self.max,
+                  "mean": self.mean, "var": self.var}
+        for name in _stats_names:
+            node._v_attrs[_prefix+name] = values[name]
+        if self.count_values and self.value_counts is not None:
+            node._v_attrs[_class_counts] = self.value_counts
+        return None
+
+
+def compute_stats(obj, count_values=False, block_bytes=2**24):
+    '''
+    RunningStats of the array obj, computed one block of rows
+    at a time, such that float64 temporaries are of roughly
+    block_bytes bytes.
+    '''
+    stats = RunningStats(count_values=count_values, block_bytes=block_bytes)
+    stats.update(obj)
+    return stats
+
+
+def read_stats(node):
+    '''
+    Statistics stored with node, as a dict mapping "count",
+    "min", "max", "mean", "var" (and "class_counts", if
+    present) to arrays; None if the node has none stored.
+    '''
+    attrs = node._v_attrs
+    if _prefix+"mean" not in attrs:
+        return None
+    out = {name: np.asarray(attrs[_prefix+name]) for name in _stats_names}
+    if _class_counts in attrs:
+        out[_class_counts] = np.asarray(attrs[_class_counts])
+    return out
+
+
+def get_stats(toread, name="X"):
+    '''
+    Read the statistics stored with node "name" of the HDF5 file
+    toread (see read_stats); this never touches the data itself.
+    '''
+    with tables.open_file(toread, mode="r") as f:
+        return read_stats(node=f.get_node(where=f.root, name=name))
+
+
+def get_minmax_stored(toread, dtype, name="X"):
+    '''
+    Per-feature (min, max), each of shape (1,num_features) and
+    cast to dtype, from the statistics stored with node "name"
+    of toread; None if there are none. Since casting preserves
+    order, these equal the min and max of the data after it has
+    been cast to dtype, so a pass over the data is not needed.
+    '''
+    stats = get_stats(toread=toread, name=name)
+    if stats is None:
+        return None
+    return (stats["min"].astype(dtype).reshape((1,-1)),
+            stats["max"].astype(dtype).reshape((1,-1)))
+
+
+###############################################################################
@@ -0,0 +1,192 @@
+'''Data: out-of-core minibatch streaming from stored datasets.'''
+
+## External modules.
+import numpy as np
+import os
+import time
+
+## Internal modules.
+from mml.data import get_data
+from mml.data.stats import get_minmax_stored
+from mml.utils.linalg import onehot
+
+
+###############################################################################
+
+
+def get_minmax(X, chunk_rows):
+    '''
+    Per-feature min and max (each with shape (1,num_features))
+    of a (possibly lazy) array X, computed in a single pass
+    over blocks of chunk_rows rows.
+    '''
+    minvec = None
+    maxvec = None
+    for start in range(0, len(X), chunk_rows):
+        X_chunk = X[start:(start+chunk_rows)]
+        chunk_min = X_chunk.min(axis=0, keepdims=True)
+        chunk_max = X_chunk.max(axis=0, keepdims=True)
+        if minvec is None:
+            minvec, maxvec = (chunk_min, chunk_max)
+        else:
+            np.minimum(minvec, chunk_min, out=minvec)
+            np.maximum(maxvec, chunk_max, out=maxvec)
+    return (minvec, maxvec)
+
+
+class BatchStream:
+    '''
+    Iterable over minibatches (X_batch, y_batch) of a stored
+    dataset, without ever loading the full dataset.
+
+    Each pass (i.e., each call to iter()) reads the data in
+    contiguous chunks of chunk_rows rows, visiting chunks in
+    a random order. Chunks are pooled in a buffer of at most
+    buffer_chunks chunks, and rows are shuffled within this
+    buffer before being cut into batches. Per-feature min-max
+    normalization and one-hot encoding are done per batch, so
+    batches match what get_data_general would give, and can be
+    passed directly to Algorithm.update(X=X_batch, y=y_batch).
+    Memory use is bounded by the buffer size.
+
+    After each pass, the throughput (rows/sec) is printed
+    and stored as the attribute rows_per_sec.
+    '''
+
+    def __init__(self, dataset, paras, rg, directory, batch_size,
+                 start=0, stop=None, chunk_rows=None, buffer_chunks=8,
+                 do_normalize=True, do_onehot=True, drop_last=False):
+        '''
+        - start, stop: only rows in range(start,stop) are used.
+        - chunk_rows: rows per contiguous read; if None, use the
+          block size of the underlying lazy array.
+        - drop_last: if True, skip the final incomplete batch.
+        '''
+        self.X, self.y = get_data(dataset=dataset, paras=paras, rg=rg,
+                                  directory=directory, lazy=True)
+        self.paras = paras
+        self.rg = rg
+        self.batch_size = batch_size
+        self.start = start
+        self.stop = len(self.X) if stop is None else stop
+        if chunk_rows is None:
+            chunk_rows = self.X.block_rows
+        self.chunk_rows = chunk_rows
+        self.buffer_chunks = buffer_chunks
+        self.drop_last = drop_last
+        self.rows_per_sec = None
+
+        ## One-hot encoding only makes sense for classification.
+        self.do_onehot = do_onehot and self.y is not None and (
+            paras["type"] == "classification"
+        )
+
+        ## Normalization requires per-feature statistics; use those
+        ## stored at conversion time, else make a pass over X.
+        if do_normalize:
+            minmax = get_minmax_stored(
+                toread=os.path.join(directory, dataset,
+                                    "{}.h5".format(dataset)),
+                dtype=self.X.dtype, name="X"
+            )
+            if minmax is None or minmax[0].shape[1] != self.X.shape[1]:
+                minmax = get_minmax(X=self.X, chunk_rows=chunk_rows)
+            minvec, maxvec = minmax
+            self.shift = minvec
+            with np.errstate(divide="ignore"):
+                self.scale = np.where(maxvec > minvec,
+                                      1.0/(maxvec-minvec), 0.0)
+            self.scale = self.scale.astype(self.X.dtype)
+        else:
+            self.shift = None
+            self.scale = None
+
+        paras.update({"num_features": self.X.shape[1],
+                      "num_labels": None if self.y is None else (
+                          self.y.shape[1]
+                      )})
+        return None
+
+
+    def __len__(self):
+        '''
+        Number of batches per pass.
+        '''
+        n = self.stop - self.start
+        if self.drop_last:
+            return n // self.batch_size
+        else:
+            return -(-n // self.batch_size)
+
+
+    def _prepare(self, X_batch, y_batch):
+        '''
+        Per-batch normalization and label encoding.
+        '''
+        if self.shift is not None:
+            X_batch -= self.shift
+            X_batch *= self.scale
+        if self.do_onehot:
+            y_batch = onehot(y=y_batch, num_classes=self.paras["num_classes"])
+        return (X_batch, y_batch)
+
+
+    def __iter__(self):
+
+        time_start = time.perf_counter()
+        num_rows = 0
+
+        ## Random order over contiguous chunks.
+        chunk_starts = np.arange(self.start, self.stop, self.chunk_rows)
+        chunk_starts = chunk_starts[self.rg.permutation(len(chunk_starts))]
+
+        ## Rows left over from the previous buffer.
+        X_left = None
+        y_left = None
+
+        for i in range(0, len(chunk_starts), self.buffer_chunks):
+
+            ## Fill up the buffer.
+            X_buf = [] if X_left is None else [X_left]
+            y_buf = [] if y_left is None else [y_left]
+            for chunk_start in chunk_starts[i:(i+self.buffer_chunks)]:
+                chunk_stop = min(chunk_start+self.chunk_rows, self.stop)
+                X_buf.append(self.X[chunk_start:chunk_stop])
+                if self.y is not None:
+                    y_buf.append(self.y[chunk_start:chunk_stop])
+            X_buf = np.concatenate(X_buf)
+            y_buf = np.concatenate(y_buf) if self.y is not None else None
+
+            ## Shuffle within the buffer window.
+            idx = self.rg.permutation(len(X_buf))
+            last_buffer = i+self.buffer_chunks >= len(chunk_starts)
+            if last_buffer:
+                num_full = len(idx)
+            else:
+                num_full = len(idx) - len(idx) % self.batch_size
+
+            for b in range(0, num_full, self.batch_size):
+                idx_batch = idx[b:min(b+self.batch_size, num_full)]
+                if len(idx_batch) < self.batch_size and self.drop_last:
+                    continue
+                X_batch = X_buf[idx_batch]
+                y_batch = None if y_buf is None else y_buf[idx_batch]
+                num_rows += len(idx_batch)
+                yield self._prepare(X_batch=X_batch, y_batch=y_batch)
+
+            ## Keep the remainder for the next buffer.
+            X_left = X_buf[idx[num_full:]] if num_full < len(idx) else None
+            if y_buf is not None and num_full < len(idx):
+                y_left = y_buf[idx[num_full:]]
+            else:
+                y_left = None
+
+        time_total = time.perf_counter()-time_start
+        self.rows_per_sec = num_rows / max(time_total, 1e-12)
+        print("BatchStream: {} rows in {:.3f}s ({:.0f} rows/sec).".format(
+            num_rows, time_total, self.rows_per_sec
+        ))
+        return None
+
+
+###############################################################################
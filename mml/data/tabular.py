@@ -0,0 +1,187 @@
+'''Data: vectorized reading and encoding of delimited text tables.'''
+
+## External modules.
+from itertools import chain, islice
+import numpy as np
+import warnings
+
+
+###############################################################################
+
+
+## For reference:
+## The tabular datasets describe their raw data with a small schema:
+## - attribute_names: names of the feature columns, in order.
+## - attribute_dict: for each name, either ["continuous"], or the list
+##   of distinct values of a categorical attribute, in the order that
+##   determines its one-hot encoding.
+## - label_dict: map from raw label strings to integer labels.
+## All of the parsing here works on whole columns at once.
+
+
+def loadtxt(toread, dtype, delimiter, skip_rows):
+    '''
+    Bulk parse of a delimited text file (or a list of its
+    lines) into a 2-D array,
+    ignoring blank lines (NumPy warns about these when reading
+    strings, since it then reads in chunks; nothing is lost).
+    '''
+    with warnings.catch_warnings():
+        warnings.filterwarnings("ignore", message="Input line")
+        return np.loadtxt(toread, delimiter=delimiter, skiprows=skip_rows,
+                          dtype=dtype, comments=None, ndmin=2)
+
+
+def lookup(col, values):
+    '''
+    Map an array of strings to integer codes, namely the
+    positions of each string within the list values. The
+    dict lookup is only done once per *distinct* string,
+    after which codes are spread out by a vectorized gather.
+    Raises a ValueError for any string not in values.
+    '''
+    table = {v: i for i, v in enumerate(values)}
+    col_unique, inverse = np.unique(col, return_inverse=True)
+    codes_unique = np.array([table.get(v, -1) for v in col_unique],
+                            dtype=np.int64)
+    unknown = col_unique[codes_unique < 0]
+    if len(unknown) > 0:
+        raise ValueError("Unknown values: {}".format(list(unknown)))
+    return codes_unique[inverse.reshape(-1)]
+
+
+def onehot_columns(columns, attribute_names, attribute_dict, dtype):
+    '''
+    Encode the (n, len(attribute_names)) array of strings
+    columns into numerical features, with each continuous
+    attribute taking one column and each categorical one
+    taking a block of one-hot columns. All the one-hot
+    entries are set by a single vectorized scatter.
+    '''
+    n = len(columns)
+    widths = [len(attribute_dict[a]) for a in attribute_names]
+    offsets = np.cumsum([0]+widths[:-1])
+    X = np.zeros((n, sum(widths)), dtype=dtype)
+
+    idx_cat = []
+    for j, attribute in enumerate(attribute_names):
+        values = attribute_dict[attribute]
+        if len(values) > 1:
+            idx_cat.append(offsets[j]+lookup(col=columns[:,j],
+                                             values=values))
+        else:
+            X[:,offsets[j]] = columns[:,j].astype(dtype)
+
+    if len(idx_cat) > 0:
+        idx_cat = np.column_stack(idx_cat) # (n, num categorical).
+        X[np.arange(n)[:,None],idx_cat] = 1
+    return X
+
+
+def encode_labels(labels, label_dict=None, label_shift=0,
+                  dtype_y=np.uint8):
+    '''
+    Turn an array of raw label strings into an array of shape
+    (n,1), either mapped through label_dict, or (if label_dict
+    is None) read as numbers and shifted by label_shift.
+    '''
+    if label_dict is None:
+        y = labels.astype(np.float64) + label_shift
+    else:
+        y = np.array(list(label_dict.values()))[
+            lookup(col=labels, values=list(label_dict.keys()))
+        ]
+    return y.astype(dtype_y).reshape((-1,1))
+
+
+def read_tabular(toread, attribute_names=None, attribute_dict=None,
+                 label_dict=None, label_shift=0,
+                 feature_cols=slice(0,-1), label_col=-1,
+                 delimiter=",", skip_rows=0, skipinitialspace=False,
+                 missing=None, label_strip=None,
+                 dtype_X=np.float32, dtype_y=np.uint8):
+    '''
+    Read a delimited text file (or an iterable over its lines)
+    in one shot, and return the pair (X, y) of features and
+    labels, with y of shape (n,1).
+    - attribute_names, attribute_dict: the schema for the
+      feature columns; if None, all features are numeric.
+    - label_dict: if not None, maps raw label strings to
+      integers; otherwise labels are numeric, and label_shift
+      is added to them (e.g., -1 to go from 1-based to 0-based).
+    - feature_cols, label_col: where features and labels are.
+    - skip_rows: number of initial rows to skip (e.g., headers).
+    - skipinitialspace: strip whitespace around each field.
+    - missing: if not None, drop rows with this string (e.g., "?")
+      in any feature column.
+    - label_strip: characters stripped from the end of labels.
+    Blank lines are ignored.
+    '''
+
+    all_numeric = (attribute_dict is None and label_dict is None
+                   and missing is None and label_strip is None)
+
+    if all_numeric:
+        ## Fast path: parse directly into numbers.
+        table = loadtxt(toread=toread, dtype=dtype_X,
+                        delimiter=delimiter, skip_rows=skip_rows)
+        X = np.ascontiguousarray(table[:,feature_cols])
+        y = table[:,label_col] + label_shift
+        return (X, y.astype(dtype_y).reshape((-1,1)))
+
+    ## General path: parse as strings, then encode column-wise.
+    table = loadtxt(toread=toread, dtype=str,
+                    delimiter=delimiter, skip_rows=skip_rows)
+    if skipinitialspace:
+        table = np.char.strip(table)
+    columns = table[:,feature_cols]
+    labels = table[:,label_col]
+
+    ## Filter out rows with missing values.
+    if missing is not None:
+        is_clean = ~(columns == missing).any(axis=1)
+        columns = columns[is_clean]
+        labels = labels[is_clean]
+
+    if attribute_dict is None:
+        X = columns.astype(dtype_X)
+    else:
+        if len(attribute_names) != columns.shape[1]:
+            raise ValueError("Schema has {} attributes; data has {}.".format(
+                len(attribute_names), columns.shape[1]
+            ))
+        X = onehot_columns(columns=columns,
+                           attribute_names=attribute_names,
+                           attribute_dict=attribute_dict,
+                           dtype=dtype_X)
+
+    if label_strip is not None:
+        labels = np.char.rstrip(labels, label_strip)
+    y = encode_labels(labels=labels, label_dict=label_dict,
+                      label_shift=label_shift, dtype_y=dtype_y)
+    return (X, y)
+
+
+def iter_tabular(toread, block_rows=2**16, skip_rows=0, **kwargs):
+    '''
+    Generator over blocks (X, y) of a delimited text file, as
+    given by read_tabular() (which takes the other arguments)
+    on each block of block_rows lines, so that only one block
+    is held in memory at once. Blocks can have fewer rows than
+    block_rows, due to blank lines and dropped missing values.
+    '''
+    with open(toread, mode="r") as f:
+        for line in islice(f, skip_rows):
+            pass
+        while True:
+            ## Start each block from a non-blank line (if any left).
+            for line in f:
+                if len(line.strip()) > 0:
+                    break
+            else:
+                break
+            yield read_tabular(toread=chain([line], islice(f, block_rows-1)),
+                               **kwargs)
+
+
+###
@@ -1,9 +1,70 @@
 '''Losses: base class definitions.'''
 
+## External modules.
+import inspect
+import numpy as np
+
+## Internal modules.
+from mml.utils.sparse import SparseJacobian
+
 
 ###############################################################################
 
 
+## For reference:
+## Model gradients (Jacobians) are treated as read-only; for linear
+## models they are views of X itself (or lazy, see SparseJacobian), so
+## they are never copied. Loss gradients are written into new arrays,
+## or into the buffers of a dict passed as out, which can be passed
+## again at each step to reuse the same memory; see weight_grads.
+## Losses written against the older grad(model, X, y) signature (with
+## no out argument) still work everywhere; see get_grads.
+
+
+def weight_grads(model_grads, coeffs, out=None):
+    '''
+    Per-example loss gradients from per-example model gradients,
+    with shape (n, ..., num_outputs), and the coefficients
+    (see Loss.grad_coeffs), with shape (n, num_outputs). The
+    model gradients are only read, never copied or modified.
+    - out: optional dict of arrays, keyed by parameter name, to
+      write the results into. Entries that are missing, or of
+      the wrong shape or dtype, are (re)allocated and stored in
+      out, so when the same dict is passed at each step, results
+      are only valid until the next step.
+    Dense results keep the (floating) dtype of the model
+    gradients; sparse ones are scaled lazily, and never use out.
+    '''
+    loss_grads = {}
+    for pn, g in model_grads.items():
+        if isinstance(g, SparseJacobian):
+            loss_grads[pn] = g.scaled(coeffs)
+            continue
+        if np.issubdtype(g.dtype, np.floating):
+            dtype = g.dtype
+        else:
+            dtype = np.result_type(g.dtype, coeffs.dtype)
+        buf = None if out is None else out.get(pn, None)
+        if buf is None or buf.shape != g.shape or buf.dtype != dtype:
+            buf = np.empty(g.shape, dtype=dtype)
+            if out is not None:
+                out[pn] = buf
+        np.multiply(g, np.expand_dims(coeffs, axis=tuple(range(1,g.ndim-1))),
+                    out=buf)
+        loss_grads[pn] = buf
+    return loss_grads
+
+
+def get_grads(loss, model, X, y, out=None):
+    '''
+    Per-example gradients loss.grad(model, X, y), passing out
+    along only if it is given and the loss's grad() accepts it.
+    '''
+    if out is None or "out" not in inspect.signature(loss.grad).parameters:
+        return loss.grad(model=model, X=X, y=y)
+    return loss.grad(model=model, X=X, y=y, out=out)
+
+
 class Loss:
     '''
     Loss objects represent a composition of a
@@ -36,8 +97,12 @@ class Loss:
     def __call__(self, model=None, X=None, y=None):
         '''
         Lets us compute loss values as loss(model,X,y).
+        Within a model.memoize() block, values are computed
+        once per loss, parameter version, and inputs.
         '''
-        return self.func(model=model, X=X, y=y)
+        return model.memoized(key=self, X=X, y=y, compute=lambda: self.func(
+            model=model, X=X, y=y
+        ))
     
     
     def func(self, model=None, X=None, y=None):
@@ -48,14 +113,82 @@ class Loss:
         raise NotImplementedError
     
     
-    def grad(self, model=None, X=None, y=None):
+    def grad(self, model=None, X=None, y=None, out=None):
         '''
-        When applicable, compute the loss gradient.
+        When applicable, compute the loss gradient. Where given,
+        out is a dict of reusable output buffers (see weight_grads).
         (implemented in child classes)
         '''
         raise NotImplementedError
     
     
+    def grad_coeffs(self, model=None, X=None, y=None):
+        '''
+        For losses that depend on the model only via its outputs
+        model(X), with shape (n, num_outputs), the derivatives of
+        the per-example losses with respect to these outputs
+        (same shape). The loss gradients are then the model
+        gradients weighted by these coefficients.
+        (implemented in child classes, where applicable)
+        '''
+        raise NotImplementedError
+
+
+    def mean_grad(self, model=None, X=None, y=None):
+        '''
+        Gradient of the mean loss over all examples, as a dict
+        with arrays of the same shape as the parameters. This is
+        all that ERM-type algorithms need; when grad_coeffs() is
+        implemented, the model reduces over examples directly
+        (see Model.grad_reduced), so per-example gradients are
+        never formed. Otherwise, this is the mean of grad().
+        '''
+        try:
+            coeffs = self.grad_coeffs(model=model, X=X, y=y)
+        except NotImplementedError:
+            return {pn: g.mean(axis=0, keepdims=False)
+                    for pn, g in self.grad(model=model, X=X, y=y).items()}
+        return model.grad_reduced(X=X, coeffs=coeffs)
+    
+    
+    def value_and_grad_coeffs(self, model=None, X=None, y=None):
+        '''
+        The pair (func(), grad_coeffs()), computed together.
+        This default shares the model outputs only (see
+        Model.memoize); child classes override it to share
+        all intermediate quantities.
+        '''
+        with model.memoize():
+            return (self(model=model, X=X, y=y),
+                    self.grad_coeffs(model=model, X=X, y=y))
+
+
+    def value_and_grad(self, model=None, X=None, y=None, mean=False,
+                       out=None):
+        '''
+        The pair of per-example losses (as func()) and loss
+        gradients (as grad(), using out), computed in one pass
+        where possible; if mean is True, the gradients are those
+        of the mean loss (as mean_grad()).
+        '''
+        try:
+            values, coeffs = self.value_and_grad_coeffs(model=model,
+                                                        X=X, y=y)
+        except NotImplementedError:
+            with model.memoize():
+                values = self(model=model, X=X, y=y)
+                if mean:
+                    return (values, self.mean_grad(model=model, X=X, y=y))
+                else:
+                    return (values, get_grads(loss=self, model=model,
+                                              X=X, y=y, out=out))
+        if mean:
+            return (values, model.grad_reduced(X=X, coeffs=coeffs))
+        else:
+            return (values, weight_grads(model_grads=model.grad(X=X),
+                                         coeffs=coeffs, out=out))
+    
+    
     def hess(self, model=None, X=None, y=None):
         '''
         When applicable, compute the loss Hessian.
@@ -1,11 +1,10 @@
 '''Losses: absolute penalty function.'''
 
 ## External modules.
-from copy import deepcopy
 import numpy as np
 
 ## Internal modules.
-from mml.losses import Loss
+from mml.losses import Loss, weight_grads
 
 
 ###############################################################################
@@ -26,22 +25,40 @@ class Absolute(Loss):
         return np.absolute(model(X=X)-y)
 
 
-    def grad(self, model, X, y):
+    def diffs(self, model, X, y):
         '''
+        Differences model(X)-y, after a shape check.
         '''
-        loss_grads = deepcopy(model.grad(X=X)) # start with model grads.
-        signs = np.sign(model(X=X)-y) # loss sub-gradient (non-composite).
+        diffs = model(X=X)-y
 
         ## Shape check to be safe.
-        if signs.ndim != 2:
+        if diffs.ndim != 2:
             raise ValueError("Require model(X)-y to have shape (n,1).")
-        elif signs.shape[1] != 1:
+        elif diffs.shape[1] != 1:
             raise ValueError("Only implemented for single-output models.")
-        else:
-            for pn, g in loss_grads.items():
-                g *= np.expand_dims(a=signs,
-                                    axis=tuple(range(2,g.ndim)))
-        return loss_grads
+        return diffs
+
+
+    def grad_coeffs(self, model, X, y):
+        '''
+        '''
+        ## Loss sub-gradient (non-composite).
+        return np.sign(self.diffs(model=model, X=X, y=y))
+
+
+    def value_and_grad_coeffs(self, model, X, y):
+        '''
+        '''
+        diffs = self.diffs(model=model, X=X, y=y)
+        return (np.absolute(diffs), np.sign(diffs))
+
+
+    def grad(self, model, X, y, out=None):
+        '''
+        '''
+        return weight_grads(model_grads=model.grad(X=X), # read-only.
+                            coeffs=self.grad_coeffs(model=model, X=X, y=y),
+                            out=out)
 
 
 ###############################################################################
@@ -2,7 +2,7 @@
 
 ## Internal modules.
 from mml.losses import Loss
-from mml.utils.linalg import onehot
+from mml.utils.linalg import label_indices, onehot
 
 
 ###############################################################################
@@ -22,17 +22,21 @@ class Zero_One(Loss):
         - The output of model(X=X) has shape (n, num_classes),
           and the elements in the jth column represent scores
           in favor of the jth class.
-        - Labels y are one-hot, i.e., (n, num_classes) shape.
+        - Labels y are one-hot, i.e., (n, num_classes) shape,
+          or integer class indices with (n, 1) shape.
         '''
 
-        num_classes = y.shape[1]
-
-        ## Convert scores into a one-hot prediction.
-        y_hat = onehot(y=model(X=X).argmax(axis=1),
-                       num_classes=num_classes)
-
-        ## Compare with true one-hot labels.
-        return (y_hat != y).any(axis=1, keepdims=True).astype(int)
+        ## Predicted class indices, shape (n,).
+        scores = model(X=X)
+        idx_hat = scores.argmax(axis=1)
+
+        ## Compare with true labels.
+        idx = label_indices(y=y, num_classes=scores.shape[1])
+        if idx is None:
+            y_hat = onehot(y=idx_hat, num_classes=scores.shape[1])
+            return (y_hat != y).any(axis=1, keepdims=True).astype(int)
+        else:
+            return (idx_hat != idx).astype(int).reshape((-1,1))
         
 
 ###############################################################################
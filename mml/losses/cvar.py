@@ -4,7 +4,7 @@
 import numpy as np
 
 ## Internal modules.
-from mml.losses import Loss
+from mml.losses import Loss, get_grads, weight_grads
 
 
 ###############################################################################
@@ -48,17 +48,96 @@ class CVaR(Loss):
         )
     
     
-    def grad(self, model, X, y):
+    def excess(self, model, X, y):
+        '''
+        Indicators (1.0 or 0.0) of base losses exceeding v.
+        '''
+        v = model.paras["v"].item() # extract scalar.
+        return np.clip(a=np.sign(self.loss(model=model, X=X, y=y)-v),
+                       a_min=0.0,
+                       a_max=None)
+
+
+    def grad_v(self, model, l_check):
+        '''
+        Per-example sub-gradients with respect to v, given
+        the indicators l_check (see excess).
+        '''
+        return np.expand_dims(
+            a=np.where(l_check>0.0, 1.0-1.0/self.alpha, 1.0),
+            axis=tuple(range(l_check.ndim,1+model.paras["v"].ndim))
+        )
+
+
+    def grad_coeffs(self, model, X, y):
+        '''
+        Not applicable: the loss also depends on v, not only on
+        the model outputs, so losses built on this one must use
+        grad() (see Loss.mean_grad).
+        '''
+        raise NotImplementedError
+
+
+    def value_and_grad_coeffs(self, model, X, y):
+        '''
+        Not applicable; see grad_coeffs().
+        '''
+        raise NotImplementedError
+
+
+    def mean_grad(self, model, X, y):
+        '''
+        Mean sub-gradient; reduced by the model where possible
+        (see Loss.mean_grad), plus the mean with respect to v.
+        '''
+        try:
+            coeffs = self.loss.grad_coeffs(model=model, X=X, y=y)
+        except NotImplementedError:
+            return super().mean_grad(model=model, X=X, y=y)
+        l_check = self.excess(model=model, X=X, y=y)
+        loss_grads = model.grad_reduced(X=X,
+                                        coeffs=coeffs*(l_check/self.alpha))
+        loss_grads["v"] = self.grad_v(model=model,
+                                      l_check=l_check).mean(axis=0)
+        return loss_grads
+    
+    
+    def value_and_grad(self, model, X, y, mean=False, out=None):
+        '''
+        CVaR losses and sub-gradients (see Loss.value_and_grad),
+        from one pass of the base loss.
+        '''
+        try:
+            losses, coeffs = self.loss.value_and_grad_coeffs(model=model,
+                                                             X=X, y=y)
+        except NotImplementedError:
+            return super().value_and_grad(model=model, X=X, y=y, mean=mean,
+                                          out=out)
+        v = model.paras["v"].item()
+        excess = losses-v
+        l_check = np.clip(a=np.sign(excess), a_min=0.0, a_max=None)
+        values = v + (1./self.alpha) * np.clip(a=excess, a_min=0.0,
+                                               a_max=None)
+        coeffs = coeffs * (l_check / self.alpha)
+        grad_v = self.grad_v(model=model, l_check=l_check)
+        if mean:
+            loss_grads = model.grad_reduced(X=X, coeffs=coeffs)
+            loss_grads["v"] = grad_v.mean(axis=0)
+        else:
+            loss_grads = weight_grads(model_grads=model.grad(X=X),
+                                      coeffs=coeffs, out=out)
+            loss_grads["v"] = grad_v
+        return (values, loss_grads)
+    
+    
+    def grad(self, model, X, y, out=None):
         '''
         '''
 
         ## Initial computations.
-        loss_grads = self.loss.grad(model=model, X=X, y=y)
-        v = model.paras["v"].item() # extract scalar.
-        vdim = model.paras["v"].ndim
-        l_check = np.clip(a=np.sign(self.loss(model=model, X=X, y=y)-v),
-                          a_min=0.0,
-                          a_max=None)
+        loss_grads = get_grads(loss=self.loss, model=model, X=X, y=y,
+                               out=out)
+        l_check = self.excess(model=model, X=X, y=y)
         ldim = l_check.ndim
 
         ## Main sub-gradient computations.
@@ -79,10 +158,7 @@ class CVaR(Loss):
                 g *= l_check / self.alpha
         
         ## Finally, sub-gradient with respect to CVaR shift parameter.
-        loss_grads["v"] = np.expand_dims(
-            a=np.where(l_check>0.0, 1.0-1.0/self.alpha, 1.0),
-            axis=tuple(range(ldim,1+vdim))
-        )
+        loss_grads["v"] = self.grad_v(model=model, l_check=l_check)
         
         ## Return gradients for all parameters being optimized.
         return loss_grads
@@ -4,7 +4,7 @@
 import numpy as np
 
 ## Internal modules.
-from mml.losses import Loss
+from mml.losses import Loss, get_grads, weight_grads
 
 
 ###############################################################################
@@ -66,18 +66,99 @@ class DRO_CR(Loss):
                                a_min=0.0, a_max=None)**cstar
     
     
-    def grad(self, model, X, y):
+    def weights(self, model, X, y):
         '''
+        Derivatives of the modified losses with respect
+        to the base losses.
         '''
-        ## Initial computations.
         cstar = self.shape / (self.shape-1.0)
-        loss_grads = self.loss.grad(model=model, X=X, y=y)
         theta = model.paras["theta"].item() # extract scalar.
-        tdim = model.paras["theta"].ndim
         losses = self.loss(model=model, X=X, y=y)
         l_check = np.where(losses>=theta, 1.0, 0.0)
         l_check *= cstar
         l_check *= np.clip(a=losses-theta, a_min=0.0, a_max=None)**(cstar-1.0)
+        return l_check
+
+
+    def grad_theta(self, model, l_check):
+        '''
+        Per-example sub-gradients with respect to theta,
+        given the weights l_check (see weights).
+        '''
+        return np.expand_dims(
+            a=1.0-l_check,
+            axis=tuple(range(l_check.ndim,1+model.paras["theta"].ndim))
+        )
+
+
+    def grad_coeffs(self, model, X, y):
+        '''
+        Not applicable: the loss also depends on theta, not only
+        on the model outputs, so losses built on this one must
+        use grad() (see Loss.mean_grad).
+        '''
+        raise NotImplementedError
+
+
+    def value_and_grad_coeffs(self, model, X, y):
+        '''
+        Not applicable; see grad_coeffs().
+        '''
+        raise NotImplementedError
+
+
+    def mean_grad(self, model, X, y):
+        '''
+        Mean sub-gradient; reduced by the model where possible
+        (see Loss.mean_grad), plus the mean with respect to theta.
+        '''
+        try:
+            coeffs = self.loss.grad_coeffs(model=model, X=X, y=y)
+        except NotImplementedError:
+            return super().mean_grad(model=model, X=X, y=y)
+        l_check = self.weights(model=model, X=X, y=y)
+        loss_grads = model.grad_reduced(X=X, coeffs=coeffs*l_check)
+        loss_grads["theta"] = self.grad_theta(model=model,
+                                              l_check=l_check).mean(axis=0)
+        return loss_grads
+    
+    
+    def value_and_grad(self, model, X, y, mean=False, out=None):
+        '''
+        DRO_CR losses and sub-gradients (see Loss.value_and_grad),
+        from one pass of the base loss.
+        '''
+        try:
+            losses, coeffs = self.loss.value_and_grad_coeffs(model=model,
+                                                             X=X, y=y)
+        except NotImplementedError:
+            return super().value_and_grad(model=model, X=X, y=y, mean=mean,
+                                          out=out)
+        cstar = self.shape / (self.shape-1.0)
+        theta = model.paras["theta"].item()
+        excess = np.clip(a=losses-theta, a_min=0.0, a_max=None)
+        values = theta + excess**cstar
+        l_check = np.where(losses>=theta, cstar, 0.0)
+        l_check *= excess**(cstar-1.0)
+        coeffs = coeffs * l_check
+        grad_theta = self.grad_theta(model=model, l_check=l_check)
+        if mean:
+            loss_grads = model.grad_reduced(X=X, coeffs=coeffs)
+            loss_grads["theta"] = grad_theta.mean(axis=0)
+        else:
+            loss_grads = weight_grads(model_grads=model.grad(X=X),
+                                      coeffs=coeffs, out=out)
+            loss_grads["theta"] = grad_theta
+        return (values, loss_grads)
+    
+    
+    def grad(self, model, X, y, out=None):
+        '''
+        '''
+        ## Initial computations.
+        loss_grads = get_grads(loss=self.loss, model=model, X=X, y=y,
+                               out=out)
+        l_check = self.weights(model=model, X=X, y=y)
         ldim = l_check.ndim
         
         ## Main sub-gradient computations.
@@ -95,10 +176,7 @@ class DRO_CR(Loss):
                 g *= l_check
 
         ## Finally, sub-gradient with respect to shift parameter.
-        loss_grads["theta"] = np.expand_dims(
-            a=1.0-l_check,
-            axis=tuple(range(ldim,1+tdim))
-        )
+        loss_grads["theta"] = self.grad_theta(model=model, l_check=l_check)
         
         ## Return gradients for all parameters being optimized.
         return loss_grads
@@ -1,11 +1,11 @@
 '''Losses: logistic loss, typical variants.'''
 
 ## External modules.
-from copy import deepcopy
 import numpy as np
 
 ## Internal modules.
-from mml.losses import Loss
+from mml.losses import Loss, weight_grads
+from mml.utils.linalg import label_indices
 
 
 ###############################################################################
@@ -23,10 +23,10 @@ class Logistic_Binary(Loss):
         return None
     
     
-    def func(self, model, X, y):
+    def signed(self, model, X, y):
         '''
-        Assumes model returns a vector of
-        *unnormalized* scores for the first class.
+        Signed activations, i.e., model(X) times the labels y,
+        after checking shapes; shape (n, 1).
         '''
 
         A = model(X) # raw activations (n, 1).
@@ -38,65 +38,78 @@ class Logistic_Binary(Loss):
         elif A.shape[1] != y.shape[1]:
             raise ValueError("The shape of A and y do not match.")
         else:
-            
-            ## Get signed activations (noting y is +1/-1 with (n,1) shape).
-            A *= y
-            
-            ## Compute losses while avoiding overflow.
-            return np.where(A >= 0.0,
-                            np.log1p(np.exp(-A)),
-                            np.log1p(np.exp(A))-A)
+            return A*y # noting y is +1/-1 with (n,1) shape.
     
     
-    def grad(self, model, X, y):
+    def func(self, model, X, y):
+        '''
+        Assumes model returns a vector of
+        *unnormalized* scores for the first class.
+        '''
+        A = self.signed(model=model, X=X, y=y)
+        
+        ## Compute losses while avoiding overflow.
+        return np.where(A >= 0.0,
+                        np.log1p(np.exp(-A)),
+                        np.log1p(np.exp(A))-A)
+    
+    
+    def grad_coeffs(self, model, X, y):
+        '''
+        Derivatives with respect to the activations; (n, 1).
+        '''
+        A = self.signed(model=model, X=X, y=y)
+        return -y * np.where(A >= 0.0,
+                             np.exp(-A)/(1.0+np.exp(-A)),
+                             1.0/(1.0+np.exp(A)))
+
+
+    def value_and_grad_coeffs(self, model, X, y):
+        '''
+        Losses and coefficients, sharing one exponential
+        exp(-|A|) of the signed activations A (which never
+        overflows).
+        '''
+        A = self.signed(model=model, X=X, y=y)
+        E = np.exp(-np.absolute(A))
+        losses = np.log1p(E) + np.clip(a=-A, a_min=0.0, a_max=None)
+        return (losses, -y * np.where(A >= 0.0, E, 1.0) / (1.0+E))
+    
+    
+    def grad(self, model, X, y, out=None):
         '''
         Assumes that model.grad returns a gradient
         with shape (n, num_features, 1), and then
         returns the loss gradient with same shape.
         '''
-        
-        A = model(X) # raw activations (n, 1).
-
-        if A.ndim != y.ndim:
-            raise ValueError("A and y do not have the same number of axes.")
-        elif len(A) != len(y):
-            raise ValueError("The number of data in A and y do not match.")
-        elif A.shape[1] != y.shape[1]:
-            raise ValueError("The shape of A and y do not match.")
-        else:
-            
-            ## Get signed activations (noting y is +1/-1 with (n,1) shape).
-            A *= y
-            
-            coeffs = -y * np.where(A >= 0.0,
-                                   np.exp(-A)/(1.0+np.exp(-A)),
-                                   1.0/(1.0+np.exp(A)))
 
-            ## Change from (n, 1) to (n, 1, 1) for broadcasting.
-            coeffs_exp = np.expand_dims(coeffs, axis=1)
+        ## Change from (n, 1) to (n, 1, 1) for broadcasting.
+        coeffs = self.grad_coeffs(model=model, X=X, y=y)
+        coeffs_exp = np.expand_dims(coeffs, axis=1)
+        
+        ## Final computations (see weight_grads).
+        model_grads = model.grad(X=X)
+        for pn, g in model_grads.items():
             
-            ## Final computations.
-            loss_grads = deepcopy(model.grad(X=X))
-            for pn, g in loss_grads.items():
-                
-                ## Before updating, do a shape check to be safe.
-                if g.ndim != coeffs_exp.ndim:
-                    raise ValueError("g.ndim != coeffs_exp.ndim.")
-                elif g.shape[0] != len(coeffs_exp):
-                    raise ValueError("g.shape[0] != len(coeffs_exp).")
-                elif g.shape[2] != coeffs_exp.shape[2]:
-                    raise ValueError("g.shape[2] != coeffs_exp.shape[2].")
-                else:
-                    g *= coeffs_exp
+            ## Before updating, do a shape check to be safe.
+            if g.ndim != coeffs_exp.ndim:
+                raise ValueError("g.ndim != coeffs_exp.ndim.")
+            elif g.shape[0] != len(coeffs_exp):
+                raise ValueError("g.shape[0] != len(coeffs_exp).")
+            elif g.shape[2] != coeffs_exp.shape[2]:
+                raise ValueError("g.shape[2] != coeffs_exp.shape[2].")
         
-            return loss_grads
+        return weight_grads(model_grads=model_grads, coeffs=coeffs, out=out)
 
 
 class Logistic(Loss):
     '''
     Assumes the following shapes.
     X: (n, num_features)
-    y: (n, num_classes)
+    y: (n, num_classes) one-hot labels, or (n, 1)
+       integer class indices (see utils.linalg.label_indices).
+    With class indices, the label terms are computed by
+    gathering/scattering rather than dense multiplication.
     '''
     
     def __init__(self, name=None):
@@ -110,9 +123,13 @@ class Logistic(Loss):
         *unnormalized* scores; one per class.
         '''
         A_raw = model(X) # raw activations (n, num_classes).
+        idx = label_indices(y=y, num_classes=A_raw.shape[1])
         
         ## Initial loss term.
-        loss = -np.multiply(A_raw,y).sum(axis=1,keepdims=True)
+        if idx is None:
+            loss = -np.multiply(A_raw,y).sum(axis=1,keepdims=True)
+        else:
+            loss = -np.take_along_axis(A_raw, idx[:,None], axis=1)
         
         ## Further computations.
         maxes = A_raw.max(axis=1,keepdims=True) # use to avoid overflow.
@@ -120,25 +137,64 @@ class Logistic(Loss):
         return loss
 
 
-    def grad(self, model, X, y):
+    def grad_coeffs(self, model, X, y):
         '''
-        Assumes that model.grad returns a grad/Jacobian
-        with shape (n, num_features, num_classes).
-        Returns the loss grad/Jacobian with same shape.
+        Derivatives with respect to the activations, namely
+        the differences between class probabilities and the
+        one-hot labels; shape (n, num_classes).
         '''
-
-        ## Activations and difference computations.
         D = model(X) # raw activations (n, num_classes).
+        idx = label_indices(y=y, num_classes=D.shape[1])
         D = np.exp(D-D.max(axis=1,keepdims=True)) # avoiding overflow.
         D = np.divide(D,D.sum(axis=1,keepdims=True)) # probabilities.
-        D -= y # differences (thus, "D").
+        if idx is None:
+            D -= y # differences (thus, "D").
+        else:
+            D[np.arange(len(D)),idx] -= 1.0
+        return D
+
+
+    def value_and_grad_coeffs(self, model, X, y):
+        '''
+        Losses and coefficients, sharing the activations and
+        their (shifted) exponentials.
+        '''
+        A_raw = model(X) # raw activations (n, num_classes).
+        idx = label_indices(y=y, num_classes=A_raw.shape[1])
+        maxes = A_raw.max(axis=1,keepdims=True) # use to avoid overflow.
+        D = np.exp(A_raw-maxes)
+        sums = D.sum(axis=1,keepdims=True)
+
+        ## Losses, as in func().
+        if idx is None:
+            loss = -np.multiply(A_raw,y).sum(axis=1,keepdims=True)
+        else:
+            loss = -np.take_along_axis(A_raw, idx[:,None], axis=1)
+        loss += np.log(sums)+maxes
+
+        ## Differences, as in grad_coeffs().
+        D /= sums # probabilities.
+        if idx is None:
+            D -= y
+        else:
+            D[np.arange(len(D)),idx] -= 1.0
+        return (loss, D)
+
+
+    def grad(self, model, X, y, out=None):
+        '''
+        Assumes that model.grad returns a grad/Jacobian
+        with shape (n, num_features, num_classes).
+        Returns the loss grad/Jacobian with same shape.
+        '''
 
         ## Change from (n, num_classes) to (n, 1, num_classes).
+        D = self.grad_coeffs(model=model, X=X, y=y)
         D_exp = np.expand_dims(D, axis=1) # enables broadcasting.
         
-        ## Final computations.
-        loss_grads = deepcopy(model.grad(X=X))
-        for pn, g in loss_grads.items():
+        ## Final computations (see weight_grads).
+        model_grads = model.grad(X=X)
+        for pn, g in model_grads.items():
 
             ## Before updating, do a shape check to be safe.
             if g.ndim != D_exp.ndim:
@@ -147,10 +203,8 @@ class Logistic(Loss):
                 raise ValueError("g.shape[0] != len(D_exp).")
             elif g.shape[2] != D_exp.shape[2]:
                 raise ValueError("g.shape[2] != D_exp.shape[2].")
-            else:
-                g *= D_exp
 
-        return loss_grads
+        return weight_grads(model_grads=model_grads, coeffs=D, out=out)
     
 
 ###############################################################################
@@ -1,11 +1,10 @@
 '''Losses: binary classification margin and related losses.'''
 
 ## External modules.
-from copy import deepcopy
 import numpy as np
 
 ## Internal modules.
-from mml.losses import Loss
+from mml.losses import Loss, weight_grads
 
 
 ###############################################################################
@@ -25,10 +24,11 @@ class Margin_Binary(Loss):
         return None
     
     
-    def func(self, model, X, y):
+    def margins(self, model, X, y):
         '''
-        Assumes the model returns a score for the
-        positive class.
+        Signed scores, i.e., model(X) times the labels y, after
+        checking shapes. Assumes the model returns a score for
+        the positive class.
         '''
         S = model(X) # raw scores, should have shape (n,1).
         if S.ndim != y.ndim:
@@ -38,53 +38,70 @@ class Margin_Binary(Loss):
         elif S.shape[1] != y.shape[1]:
             raise ValueError("The shape of S and y do not match.")
         else:
-            L = -S*y
-            if self.hinge:
-                L += self.threshold
-                np.clip(a=L, a_min=0.0, a_max=None, out=L)
-            return L
+            return S*y
+    
+    
+    def func(self, model, X, y):
+        '''
+        Assumes the model returns a score for the
+        positive class.
+        '''
+        L = -self.margins(model=model, X=X, y=y)
+        if self.hinge:
+            L += self.threshold
+            np.clip(a=L, a_min=0.0, a_max=None, out=L)
+        return L
     
     
-    def grad(self, model, X, y):
+    def grad_coeffs(self, model, X, y):
+        '''
+        Derivatives with respect to the scores; shape (n,1).
+        '''
+        M = self.margins(model=model, X=X, y=y)
+        if self.hinge:
+            return np.where(M <= self.threshold, -y, 0.0)
+        else:
+            return -y
+
+
+    def value_and_grad_coeffs(self, model, X, y):
+        '''
+        Losses and coefficients from one set of margins.
+        '''
+        L = -self.margins(model=model, X=X, y=y)
+        if self.hinge:
+            L += self.threshold
+            coeffs = np.where(L >= 0.0, -y, 0.0)
+            np.clip(a=L, a_min=0.0, a_max=None, out=L)
+        else:
+            coeffs = -y
+        return (L, coeffs)
+    
+    
+    def grad(self, model, X, y, out=None):
         '''
         Assumes that model.grad returns gradients
         with shape (n, num_features, 1), and then
         returns the loss gradient with same shape.
         '''
+
+        ## Change from (n, 1) to (n, 1, 1) for broadcasting.
+        coeffs = self.grad_coeffs(model=model, X=X, y=y)
+        coeffs_exp = np.expand_dims(coeffs, axis=1)
         
-        S = model(X) # raw scores, should have shape (n,1).
-        if S.ndim != y.ndim:
-            raise ValueError("S and y do not have the same number of axes.")
-        elif len(S) != len(y):
-            raise ValueError("The number of data in S and y do not match.")
-        elif S.shape[1] != y.shape[1]:
-            raise ValueError("The shape of S and y do not match.")
-        else:
-            
-            ## First compute the relevant coefficients.
-            if self.hinge:
-                coeffs = np.where(S*y <= self.threshold, -y, 0.0)
-            else:
-                coeffs = -y
-            
-            ## Change from (n, 1) to (n, 1, 1) for broadcasting.
-            coeffs_exp = np.expand_dims(coeffs, axis=1)
+        ## Final gradient computations (see weight_grads).
+        model_grads = model.grad(X=X)
+        for pn, g in model_grads.items():
             
-            ## Final gradient computations.
-            loss_grads = deepcopy(model.grad(X=X))
-            for pn, g in loss_grads.items():
-                
-                ## Before updating, do a shape check to be safe.
-                if g.ndim != coeffs_exp.ndim:
-                    raise ValueError("g.ndim != coeffs_exp.ndim.")
-                elif g.shape[0] != len(coeffs_exp):
-                    raise ValueError("g.shape[0] != len(coeffs_exp).")
-                elif g.shape[2] != coeffs_exp.shape[2]:
-                    raise ValueError("g.shape[2] != coeffs_exp.shape[2].")
-                else:
-                    g *= coeffs_exp
+            ## Before updating, do a shape check to be safe.
+            if g.ndim != coeffs_exp.ndim:
+                raise ValueError("g.ndim != coeffs_exp.ndim.")
+            elif g.shape[0] != len(coeffs_exp):
+                raise ValueError("g.shape[0] != len(coeffs_exp).")
+            elif g.shape[2] != coeffs_exp.shape[2]:
+                raise ValueError("g.shape[2] != coeffs_exp.shape[2].")
         
-            return loss_grads
+        return weight_grads(model_grads=model_grads, coeffs=coeffs, out=out)
 
 
 ###############################################################################
@@ -1,11 +1,10 @@
 '''Losses: quadratic penalty function.'''
 
 ## External modules.
-from copy import deepcopy
 import numpy as np
 
 ## Internal modules.
-from mml.losses import Loss
+from mml.losses import Loss, weight_grads
 
 
 ###############################################################################
@@ -26,22 +25,32 @@ class Quadratic(Loss):
         return (model(X=X)-y)**2 / 2.0
 
 
-    def grad(self, model, X, y):
+    def grad_coeffs(self, model, X, y):
         '''
         '''
-        loss_grads = deepcopy(model.grad(X=X)) # start with model grads.
-        diffs = model(X=X)-y # then loss grads (non-composite).
+        diffs = model(X=X)-y # loss grads (non-composite).
 
         ## Shape check to be safe.
         if diffs.ndim != 2:
             raise ValueError("Require model(X)-y to have shape (n,1).")
         elif diffs.shape[1] != 1:
             raise ValueError("Only implemented for single-output models.")
-        else:
-            for pn, g in loss_grads.items():
-                g *= np.expand_dims(a=diffs,
-                                    axis=tuple(range(2,g.ndim)))
-        return loss_grads
+        return diffs
+
+
+    def value_and_grad_coeffs(self, model, X, y):
+        '''
+        '''
+        diffs = self.grad_coeffs(model=model, X=X, y=y)
+        return (diffs**2 / 2.0, diffs)
+
+
+    def grad(self, model, X, y, out=None):
+        '''
+        '''
+        return weight_grads(model_grads=model.grad(X=X), # read-only.
+                            coeffs=self.grad_coeffs(model=model, X=X, y=y),
+                            out=out)
 
 
 ###############################################################################
@@ -4,7 +4,7 @@
 import numpy as np
 
 ## Internal modules.
-from mml.losses import Loss
+from mml.losses import Loss, get_grads
 
 
 ###############################################################################
@@ -66,12 +66,37 @@ class Tilted(Loss):
         return np.exp(self.tilt*(losses-loss_shift))
     
     
-    def grad(self, model, X, y):
+    def grad_coeffs(self, model, X, y):
+        '''
+        Base loss coefficients, times the tilted losses.
+        '''
+        return self.loss.grad_coeffs(model=model, X=X, y=y) * (
+            self.func(model=model, X=X, y=y) * self.tilt
+        )
+    
+    
+    def value_and_grad_coeffs(self, model, X, y):
+        '''
+        Tilted losses and coefficients, from one pass of the
+        base loss.
+        '''
+        losses, coeffs = self.loss.value_and_grad_coeffs(model=model,
+                                                         X=X, y=y)
+        if self.tilt >= 0.0:
+            loss_shift = np.max(losses)
+        else:
+            loss_shift = np.min(losses)
+        tilted_losses = np.exp(self.tilt*(losses-loss_shift))
+        return (tilted_losses, coeffs * (tilted_losses * self.tilt))
+    
+    
+    def grad(self, model, X, y, out=None):
         '''
         '''
         tilted_losses = self.func(model=model, X=X, y=y)
         ldim = tilted_losses.ndim
-        loss_grads = self.loss.grad(model=model, X=X, y=y)
+        loss_grads = get_grads(loss=self.loss, model=model, X=X, y=y,
+                               out=out)
         
         ## Main gradient computations.
         for pn, g in loss_grads.items():
@@ -1,5 +1,12 @@
 '''Models: base class definitions.'''
 
+## External modules.
+from contextlib import contextmanager
+import numpy as np
+
+## Internal modules.
+from mml.utils.sparse import SparseJacobian
+
 
 ###############################################################################
 
@@ -34,10 +41,17 @@ class Model:
     represent a particular choice of candidate from the
     hypothesis class implicitly represented by the Model object.
 
+    Within a memoize() block, model outputs model(X) (and loss
+    values computed via Loss.__call__) are computed only once per
+    parameter version and input object; see memoized().
+
     Handy references (property, getter/setter):
     https://docs.python.org/3/library/functions.html#property
     https://stackoverflow.com/a/15930977
     '''
+
+    _version = 0 # incremented whenever the parameters change.
+    _memo = None # dict of memoized values, within memoize() only.
     
     def __init__(self, paras_init=None, name=None):
         self._paras = paras_init
@@ -64,9 +78,12 @@ class Model:
         or one can do it one element at a time,
         e.g., something like
         >> model.paras["key"] = value
-        can be done as desired.
+        can be done as desired; in-place changes like
+        this must be followed by a call to invalidate()
+        when done within a memoize() block.
         '''
         self._paras = paras_new
+        self.invalidate()
     
     
     def __str__(self):
@@ -81,7 +98,63 @@ class Model:
         '''
         Lets us compute model outputs as model(X).
         '''
-        return self.func(paras=self._paras, X=X)
+        return self.memoized(key="func", X=X, compute=lambda: self.func(
+            paras=self._paras, X=X
+        ))
+
+
+    @contextmanager
+    def memoize(self):
+        '''
+        Context manager within which memoized() values are kept,
+        e.g., for the duration of one algorithm update, during
+        which the same model outputs are otherwise recomputed
+        by each loss function and gradient call. Everything is
+        dropped on exit (unless in an enclosing memoize() block).
+        '''
+        if self._memo is not None:
+            yield self # already memoizing.
+            return
+        self._memo = {}
+        try:
+            yield self
+        finally:
+            self._memo = None
+
+
+    def invalidate(self):
+        '''
+        Note that the parameters have changed (in place), so
+        any memoized values are out of date.
+        '''
+        self._version += 1
+        if self._memo is not None:
+            self._memo.clear()
+        return None
+
+
+    def memoized(self, key, compute, X=None, y=None):
+        '''
+        Within a memoize() block, return the value stored under
+        key for the current parameters and the very same X and y
+        objects (compared by identity, not by value), computing
+        it with compute() and storing it on the first call; the
+        stored array is made read-only, as it is shared. Outside
+        memoize(), just return compute().
+        Note that inputs must not be modified in place within
+        a memoize() block.
+        '''
+        if self._memo is None:
+            return compute()
+        memo_key = (key, self._version, id(X), id(y))
+        entry = self._memo.get(memo_key, None)
+        if entry is not None and entry[0] is X and entry[1] is y:
+            return entry[2]
+        out = compute()
+        if isinstance(out, np.ndarray):
+            out.flags.writeable = False
+        self._memo[memo_key] = (X, y, out) # keeps X, y alive, so ids hold.
+        return out
 
 
     def func(self, paras=None, X=None):
@@ -95,12 +168,39 @@ class Model:
     def grad(self, paras=None, X=None):
         '''
         When applicable, compute the gradient with
-        respect to the relevant parameters.
+        respect to the relevant parameters. Gradients are
+        treated as read-only by callers, so they can be
+        views of X (or lazy, e.g., a SparseJacobian).
         (implemented in child classes)
         '''
         raise NotImplementedError
 
     
+    def grad_reduced(self, paras=None, X=None, coeffs=None):
+        '''
+        Mean over examples of the model gradients, each weighted
+        by the per-example, per-output coefficients coeffs, with
+        shape (n, num_outputs); for a gradient G of shape
+        (n, ..., num_outputs), this is the mean over i of the sum
+        over k of coeffs[i,k] * G[i,...,k]. By the chain rule, this
+        is the gradient of a mean loss, given the loss derivatives
+        with respect to the model outputs as coeffs.
+        This default reduces the per-example gradients as they
+        are (without copying or weighting them first); child
+        classes override it when they need not be formed at all.
+        '''
+        model_grads = self.grad(paras=paras, X=X)
+        out = {}
+        for pn, g in model_grads.items():
+            if isinstance(g, SparseJacobian):
+                out[pn] = g.scaled(coeffs).mean(axis=0)
+                continue
+            if np.issubdtype(g.dtype, np.floating):
+                coeffs = coeffs.astype(g.dtype, copy=False)
+            out[pn] = np.einsum("i...k,ik->...k", g, coeffs) / len(g)
+        return out
+
+    
     def hess(self, paras=None, X=None):
         '''
         When applicable, compute the Hessian with
@@ -2,19 +2,56 @@
 
 ## External modules.
 import numpy as np
+from scipy.sparse import issparse
 
 ## Internal modules.
 from mml.models import Model, random_init
 from mml.utils import para_shape_check
+from mml.utils.sparse import SparseJacobian
 
 
 ###############################################################################
 
 
+def mean_grad_linear(X, coeffs):
+    '''
+    Mean over examples of the gradients of a linear map X @ w
+    weighted by coeffs, i.e., X.T @ coeffs / n, for dense or
+    sparse X, or a LazyArray (reduced one block of rows at a
+    time). Coefficients are cast to the (floating) dtype of
+    X, so that X itself is never converted.
+    '''
+    if np.issubdtype(X.dtype, np.floating):
+        coeffs = coeffs.astype(X.dtype, copy=False)
+    if hasattr(X, "transpose_matmul"):
+        return X.transpose_matmul(coeffs) / X.shape[0]
+    return np.asarray(X.T @ coeffs) / X.shape[0]
+
+
+def forward_linear(X, w, block_bytes=2**24):
+    '''
+    The linear map X @ w, for dense or sparse X. When dense X
+    must be converted to the dtype of the result (e.g., float32
+    data with float64 parameters), this is done one block of
+    rows (of roughly block_bytes bytes) at a time, rather than
+    for all of X at once as in X @ w; the result is the same.
+    '''
+    if not isinstance(X, np.ndarray) or X.dtype == w.dtype:
+        return X @ w
+    dtype = np.result_type(X.dtype, w.dtype)
+    out = np.empty((X.shape[0], w.shape[1]), dtype=dtype)
+    step = max(1, block_bytes // max(X.shape[1]*dtype.itemsize, 1))
+    for start in range(0, X.shape[0], step):
+        np.matmul(X[start:(start+step)].astype(dtype), w,
+                  out=out[start:(start+step)])
+    return out
+
+
 class LinearRegression(Model):
     '''
     Linear regression model, with *one* output.
     Assumes that w_init shape (num_features, 1).
+    Inputs X can be ndarrays or scipy.sparse matrices.
     '''
     
     def __init__(self, num_features,
@@ -39,20 +76,34 @@ class LinearRegression(Model):
     
     def func(self, paras=None, X=None):
         if paras is None:
-            return np.matmul(X,self.paras["w"])
+            return forward_linear(X=X, w=self.paras["w"])
         else:
-            return np.matmul(X,paras["w"])
+            return forward_linear(X=X, w=paras["w"])
     
     
     def grad(self, paras=None, X=None):
         '''
-        Gradients have shape (n,num_features,1).
+        Gradients have shape (n,num_features,1), as a
+        read-only view of X; for sparse X, this is a
+        SparseJacobian.
         '''
         model_grads = {}
-        model_grads["w"] = np.expand_dims(X, axis=X.ndim)
+        if issparse(X):
+            model_grads["w"] = SparseJacobian(X=X, num_outputs=1)
+        else:
+            model_grads["w"] = np.expand_dims(X, axis=X.ndim)
+            model_grads["w"].flags.writeable = False
         return model_grads
 
     
+    def grad_reduced(self, paras=None, X=None, coeffs=None):
+        '''
+        Computed directly as X.T @ coeffs / n, with shape
+        (num_features,1); see Model.grad_reduced.
+        '''
+        return {"w": mean_grad_linear(X=X, coeffs=coeffs)}
+
+    
     def hess(self, paras=None, X=None):
         n, d = X.shape
         model_hessians = {}
@@ -64,6 +115,7 @@ class LinearRegression_Multi(Model):
     '''
     Linear regression model, with *multiple* outputs.
     Assumes that w_init shape (num_features, num_outputs).
+    Inputs X can be ndarrays or scipy.sparse matrices.
     '''
     
     def __init__(self, num_features, num_outputs,
@@ -91,23 +143,37 @@ class LinearRegression_Multi(Model):
         Multi-valued output; shape (n, num_outputs).
         '''
         w = paras["w"] if paras is not None else self.paras["w"]
-        return np.matmul(X,w)
+        return forward_linear(X=X, w=w)
     
     
     def grad(self, paras=None, X=None):
         '''
-        Returns the Jacobian; shape (n, num_features, num_outputs).
+        Returns the Jacobian; shape (n, num_features, num_outputs),
+        as a read-only view of X. For sparse X, this is a
+        SparseJacobian.
         '''
         if paras is None:
             num_classes = self.paras["w"].shape[1]
         else:
             num_classes = paras["w"].shape[1]
         model_grads = {}
-        model_grads["w"] = np.broadcast_to(
-            array=np.expand_dims(X, axis=len(X.shape)),
-            shape=X.shape+(num_classes,)
-        )
+        if issparse(X):
+            model_grads["w"] = SparseJacobian(X=X, num_outputs=num_classes)
+        else:
+            model_grads["w"] = np.broadcast_to(
+                array=np.expand_dims(X, axis=len(X.shape)),
+                shape=X.shape+(num_classes,)
+            )
         return model_grads
+
+
+    def grad_reduced(self, paras=None, X=None, coeffs=None):
+        '''
+        Computed directly as X.T @ coeffs / n, with shape
+        (num_features, num_outputs), never forming the
+        Jacobian; see Model.grad_reduced.
+        '''
+        return {"w": mean_grad_linear(X=X, coeffs=coeffs)}
     
     
 ###############################################################################
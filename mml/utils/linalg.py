@@ -62,6 +62,25 @@ def pwd_fast(A, B):
     return np.sqrt(out)
 
 
+def permute_rows(A, idx, block_bytes=2**26):
+    '''
+    Re-order the rows of A in place, such that afterwards
+    A[i,...] is what A[idx[i],...] was before; idx must
+    be a permutation of range(len(A)). The result is the
+    same as A = A[idx,...], but rather than a full copy, only
+    a temporary of roughly block_bytes bytes is required,
+    since rows are moved one block of columns at a time.
+    '''
+    A_flat = A.reshape((len(A),-1)) # view, since A is C-contiguous.
+    if not np.shares_memory(A_flat, A):
+        raise ValueError("A must allow a 2-dim view of its rows.")
+    num_cols = A_flat.shape[1]
+    col_step = max(1, block_bytes // max(len(A)*A.itemsize,1))
+    for j in range(0, num_cols, col_step):
+        A_flat[:,j:(j+col_step)] = A_flat[idx,j:(j+col_step)]
+    return A
+
+
 def onehot(y, num_classes):
     '''
     Assumes y is (n,1) shaped array of labels
@@ -77,4 +96,27 @@ def onehot(y, num_classes):
         return np.eye(num_classes, dtype=y.dtype)[y.reshape(-1)]
 
 
+def label_indices(y, num_classes):
+    '''
+    Labels for classification come in one of two forms:
+    - one-hot, with shape (n,num_classes);
+    - class indices, with shape (n,1), integer valued,
+      as given by get_data_general(..., do_onehot=False).
+    For the latter (when num_classes > 1), return the class
+    indices as a flat (n,) view; for the former, return None.
+    '''
+    if num_classes > 1 and y.shape[1] == 1:
+        if not np.issubdtype(y.dtype, np.integer):
+            raise TypeError("Class index labels must be integers.")
+        return y.reshape(-1)
+    elif y.shape[1] == num_classes:
+        return None
+    else:
+        raise ValueError(
+            "Labels have shape {}, but there are {} classes.".format(
+                y.shape, num_classes
+            )
+        )
+
+
 ###############################################################################
@@ -0,0 +1,127 @@
+'''Utils: support for sparse (scipy.sparse) inputs.'''
+
+## External modules.
+import numpy as np
+from scipy.sparse import issparse
+
+
+###############################################################################
+
+
+class SparseJacobian:
+    '''
+    Per-example gradients of a linear map with sparse inputs X,
+    i.e., the (n, num_features, num_outputs) array G with
+    G[i,j,k] = X[i,j] * C[i,k], kept in factored form. The sparse
+    X is shared (never copied or densified), and only the dense
+    (n, num_outputs) coefficients C are stored, so memory use is
+    proportional to the number of non-zeros in X.
+
+    Supports the operations that losses and algorithms apply to
+    dense gradient arrays:
+    - in-place scaling by per-example factors, i.e., g *= c, with
+      c a scalar or of shape (n,1,1) or (n,1,num_outputs);
+    - the mean over examples, computed as X.T @ C / n;
+    - densifying blocks of features (see blocks()), for
+      coordinate-wise computations with bounded memory.
+    '''
+
+    ndim = 3
+
+    def __init__(self, X, num_outputs=1, coeffs=None):
+        if not issparse(X):
+            raise TypeError("X must be a scipy.sparse matrix.")
+        self.X = X.tocsr()
+        n, d = self.X.shape
+        if coeffs is None:
+            coeffs = np.ones((n, num_outputs), dtype=self.X.dtype)
+        elif coeffs.shape != (n, num_outputs):
+            raise ValueError("coeffs must have shape (n, num_outputs).")
+        self.coeffs = coeffs
+        self.shape = (n, d, num_outputs)
+        self._X_csc = None
+        return None
+
+
+    def __len__(self):
+        return self.shape[0]
+
+
+    @property
+    def dtype(self):
+        return np.result_type(self.X.dtype, self.coeffs.dtype)
+
+
+    def __deepcopy__(self, memo):
+        '''
+        Copies only the coefficients; X is shared.
+        '''
+        return SparseJacobian(X=self.X, num_outputs=self.shape[2],
+                              coeffs=np.copy(self.coeffs))
+
+
+    def __imul__(self, other):
+        other = np.asarray(other)
+        if other.ndim == 0:
+            self.coeffs *= other
+        elif other.ndim == 3 and len(other) == len(self) and (
+                other.shape[1] == 1
+        ):
+            self.coeffs *= other[:,0,:]
+        else:
+            raise ValueError(
+                "Cannot scale per-example gradients by shape {}.".format(
+                    other.shape
+                )
+            )
+        return self
+
+
+    def scaled(self, other):
+        '''
+        New SparseJacobian with coefficients coeffs * other, for
+        other of shape (n, num_outputs) (or broadcastable to
+        it); this one is left as is, and X is shared.
+        '''
+        coeffs = np.empty_like(self.coeffs)
+        np.multiply(self.coeffs, other, out=coeffs) # as with *= (same dtype).
+        return SparseJacobian(X=self.X, num_outputs=self.shape[2],
+                              coeffs=coeffs)
+
+
+    def mean(self, axis=0, keepdims=False):
+        '''
+        Mean over examples, shape (num_features, num_outputs),
+        or (1, num_features, num_outputs) if keepdims is True.
+        '''
+        if axis != 0:
+            raise ValueError("Only the mean over examples (axis=0).")
+        out = np.asarray(self.X.T @ self.coeffs) / len(self)
+        return np.expand_dims(out, axis=0) if keepdims else out
+
+
+    def toarray(self, start=0, stop=None):
+        '''
+        Dense (n, stop-start, num_outputs) array of per-example
+        gradients for features in range(start,stop).
+        '''
+        if self._X_csc is None:
+            self._X_csc = self.X.tocsc() # fast column slicing.
+        X_block = self._X_csc[:,start:stop].toarray()
+        return np.expand_dims(X_block, axis=2) * np.expand_dims(
+            self.coeffs, axis=1
+        )
+
+
+    def blocks(self, block_bytes=2**26):
+        '''
+        Generator over dense blocks (see toarray) covering all
+        features in order, each of roughly block_bytes bytes.
+        '''
+        n, d, k = self.shape
+        step = max(1, block_bytes // max(n*k*self.dtype.itemsize, 1))
+        for start in range(0, d, step):
+            yield self.toarray(start=start, stop=min(start+step, d))
+
+
+###############################################################################